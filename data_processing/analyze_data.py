@@ -2,19 +2,19 @@
 
 ## pylint: disable=too-many-locals
 
-import json
 import os
 
 from collections import defaultdict
 
 import constants as cnst
+import data_file
 import gis
 from prop_stats import getStats
 
 ROOT            = "/home/charles/Projects/cambridge_property_db/"
 GEOJSON         = os.path.join(ROOT, "geojson")
 STATS           = os.path.join(ROOT, "stats")
-data_path       = os.path.join(ROOT, "all_data.json")
+data_path       = os.path.join(ROOT, "all_data.ndjson")
 blocks_path     = os.path.join(GEOJSON, "ADDRESS_MasterAddressBlocks.geojson")
 blocks_out_path = os.path.join(STATS, "all_percentile.csv")
 zones_out_path  = os.path.join(STATS, "zones_all_percentile.csv")
@@ -38,17 +38,16 @@ MAX_FAR = None
 
 
 def main():
-    raw_data = None
-    with open(data_path) as f:
-        raw_data = json.load(f)
+    ## Read again on every pass over the buildings
+    buildings = data_file.Buildings(data_path)
 
-    writeBlockStats(raw_data, blocks_path, blocks_out_path)
-    #writeZoneStats(raw_data, zones_out_path)
-    #writeZoneStats(raw_data, zones_summary, summary=True)
-    #writeZoneBlocksStats(raw_data, blocks_path, zones_all_path)
-    #writeAreaStats(raw_data, areas_out_path)
-    #writeAreaStats(raw_data, areas_summary, summary=True)
-    #writeAreaBlocksStats(raw_data, blocks_path, areas_all_path)
+    writeBlockStats(buildings, blocks_path, blocks_out_path)
+    #writeZoneStats(buildings, zones_out_path)
+    #writeZoneStats(buildings, zones_summary, summary=True)
+    #writeZoneBlocksStats(buildings, blocks_path, zones_all_path)
+    #writeAreaStats(buildings, areas_out_path)
+    #writeAreaStats(buildings, areas_summary, summary=True)
+    #writeAreaBlocksStats(buildings, blocks_path, areas_all_path)
 
 
 def writeCsv(rows, path):
@@ -59,16 +58,16 @@ def writeCsv(rows, path):
             f.write("\n")
 
 
-def makeBlockGisIdMap(data, block_gis):
+def makeBlockGisIdMap(buildings, block_gis):
     geo_id_map = {}
-    for b in data['buildings']:
+    for b in buildings:
         block = b['block']
         geo_id_map[block] = block_gis.getGeoId(block)
 
     return geo_id_map
 
 
-def calcBlockStats(data, *, zones=None, area=None):
+def calcBlockStats(buildings, *, zones=None, area=None):
     ## pylint: disable=too-many-locals
     block_far  = defaultdict(list)
     block_ladu = defaultdict(list)
@@ -76,7 +75,7 @@ def calcBlockStats(data, *, zones=None, area=None):
     zones      = zones or ZONES
 
     ## Go through each building and get the dimensions
-    for b in data['buildings']:
+    for b in buildings:
         block = b['block']
         dim = b['dimensions']
         if not dim or dim['OPEN'] < 0:
@@ -105,14 +104,14 @@ def calcBlockStats(data, *, zones=None, area=None):
     return (block_far_stats, block_ladu_stats, block_os_stats)
 
 
-def writeBlockStats(data, block_gis, out_path, *, zones=None, area=None, geo_id_map=None):
+def writeBlockStats(buildings, block_gis, out_path, *, zones=None, area=None, geo_id_map=None):
     geo_id_map = geo_id_map or {}
     if isinstance(block_gis, str):
-        block_gis = gis.CityBlocks(block_gis)
+        block_gis = gis.CityBlocks(block_gis, index_only=True)
     elif not isinstance(block_gis, gis.CityBlocks):
         raise ValueError("Argument 'block_gis' must be either of type 'str' or 'gis.CityBlocks'. Found:" + type(block_gis))
 
-    block_far_stats, block_ladu_stats, block_os_stats = calcBlockStats(data, zones=zones, area=area)
+    block_far_stats, block_ladu_stats, block_os_stats = calcBlockStats(buildings, zones=zones, area=area)
     ## Produce the rows
     rows = []
     for block in block_far_stats.keys():
@@ -154,12 +153,12 @@ def writeBlockStats(data, block_gis, out_path, *, zones=None, area=None, geo_id_
     writeCsv(rows, out_path)
 
 
-def calcZoneStats(data):
+def calcZoneStats(buildings):
     zone_far  = defaultdict(list)
     zone_ladu = defaultdict(list)
     zone_os   = defaultdict(list)
 
-    for b in data['buildings']:
+    for b in buildings:
         if not b['zone'] or 'dimensions' not in b:
             continue
 
@@ -179,12 +178,12 @@ def calcZoneStats(data):
     return (far_stats, ladu_stats, os_stats)
 
 
-def calcAreaStats(data):
+def calcAreaStats(buildings):
     area_far  = defaultdict(list)
     area_ladu = defaultdict(list)
     area_os   = defaultdict(list)
 
-    for b in data['buildings']:
+    for b in buildings:
         if not b['neighborhood'] or 'dimensions' not in b:
             continue
 
@@ -204,12 +203,12 @@ def calcAreaStats(data):
     return (far_stats, ladu_stats, os_stats)
 
 
-def writeZoneStats(data, out_path, summary=True):
-    writeCsv(makeKeyStatsRows('zone', *calcZoneStats(data), summary=summary), out_path)
+def writeZoneStats(buildings, out_path, summary=True):
+    writeCsv(makeKeyStatsRows('zone', *calcZoneStats(buildings), summary=summary), out_path)
 
 
-def writeAreaStats(data, out_path, *, summary=False):
-    writeCsv(makeKeyStatsRows('neighborhood', *calcAreaStats(data), summary=summary), out_path)
+def writeAreaStats(buildings, out_path, *, summary=False):
+    writeCsv(makeKeyStatsRows('neighborhood', *calcAreaStats(buildings), summary=summary), out_path)
 
 
 def makeKeyStatsRows(key, key_far_stats, key_ladu_stats, key_os_stats, *, summary=False):
@@ -264,23 +263,23 @@ def makeKeyStatsRows(key, key_far_stats, key_ladu_stats, key_os_stats, *, summar
     return [columns] + rows
 
 
-def writeZoneBlocksStats(data, gis_path, out_path):
-    block_gis = gis.CityBlocks(gis_path)
-    geo_id_map = makeBlockGisIdMap(data, block_gis)
+def writeZoneBlocksStats(buildings, gis_path, out_path):
+    block_gis = gis.CityBlocks(gis_path, index_only=True)
+    geo_id_map = makeBlockGisIdMap(buildings, block_gis)
     for zone in cnst.ALL_ZONES:
-        writeBlockStats(data, block_gis, os.path.join(out_path, f"zone_{zone}_blocks.csv"), zones=[zone], geo_id_map=geo_id_map)
+        writeBlockStats(buildings, block_gis, os.path.join(out_path, f"zone_{zone}_blocks.csv"), zones=[zone], geo_id_map=geo_id_map)
 
 
-def writeAreaBlocksStats(data, gis_path, out_path):
-    block_gis = gis.CityBlocks(gis_path)
-    geo_id_map = makeBlockGisIdMap(data, block_gis)
-    areas = { x['neighborhood'] for x in data['buildings'] }
+def writeAreaBlocksStats(buildings, gis_path, out_path):
+    block_gis = gis.CityBlocks(gis_path, index_only=True)
+    geo_id_map = makeBlockGisIdMap(buildings, block_gis)
+    areas = { x['neighborhood'] for x in buildings }
     for area in areas:
         clean = area.lower()
         for x in [' ', '/']:
             clean = clean.replace(x, '_')
 
-        writeBlockStats(data, block_gis, os.path.join(out_path, f"neighborhood_{clean}_blocks.csv"), area=area, geo_id_map=geo_id_map)
+        writeBlockStats(buildings, block_gis, os.path.join(out_path, f"neighborhood_{clean}_blocks.csv"), area=area, geo_id_map=geo_id_map)
 
 
 main()
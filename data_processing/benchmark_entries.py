@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+## Compare load time and memory of the entry record types against the old
+## dict backed entries and the columnar mode
+##
+## Usage: benchmark_entries.py [<csv dir>]
+##     where csv dir holds the source files, ROOT/csvs by default
+
+import csv
+import os
+import sys
+import time
+import tracemalloc
+
+import data_sources as ds
+from columnar import ColumnTable
+
+ROOT = "/home/charles/Projects/cambridge_property_db/"
+DATA = os.path.join(ROOT, "csvs")
+## Entry type, file name in the csv dir, delimiter
+SOURCES = (
+    (ds.MainDatabaseEntry,    "ASSESSING_PropertyDatabase_FY2023.csv", None),
+    (ds.WebsiteDatabaseEntry, "properties.tsv",                        "\t"),
+    (ds.MasterListEntry,      "ADDRESS_MasterAddressList.csv",         None),
+    (ds.GisEntry,             "gis_property_info.tsv",                 "\t"),
+)
+
+
+class LegacyEntry:
+    """The entry as it was before the record types: a dict copy plus an
+    attribute for every column"""
+    def __init__(self, attrs, required_columns, int_columns, float_columns):
+        self.attrs = dict(attrs)
+        for key in required_columns:
+            if key not in self.attrs:
+                self.attrs[key] = None
+
+        for key in int_columns:
+            try:
+                if self.attrs[key] is not None:
+                    self.attrs[key] = int(self.attrs[key].replace(',', ''))
+            except ValueError:
+                pass
+
+        for key in float_columns:
+            try:
+                if self.attrs[key] is not None:
+                    self.attrs[key] = float(self.attrs[key].replace(',', ''))
+            except ValueError:
+                pass
+
+        for attr, val in self.attrs.items():
+            setattr(self, attr, None if val == '' else val)
+
+
+def readRows(path, delimiter):
+    with open(path, 'r', encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f) if delimiter is None else csv.DictReader(f, delimiter=delimiter)
+        return list(reader)
+
+
+def measure(fn):
+    """Return (seconds, KiB still allocated) for building what fn returns"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return (elapsed, size // 1024)
+
+
+def main(data_dir):
+    print(f"{'source':<24}{'rows':>8}{'legacy s':>10}{'legacy KiB':>12}{'record s':>10}{'record KiB':>12}{'column s':>10}{'column KiB':>12}")
+    for data_type, filename, delimiter in SOURCES:
+        path = os.path.join(data_dir, filename)
+        if not os.path.isfile(path):
+            print(f"Skipping missing {path}")
+            continue
+
+        ## Parse the file once so only the entry construction is timed. The
+        ## columnar load includes reading the file, so it is an upper bound
+        rows = readRows(path, delimiter)
+        legacy = measure(lambda: [
+            LegacyEntry(x, data_type.COLUMNS, data_type.INT_COLUMNS, data_type.FLOAT_COLUMNS) for x in rows ## pylint: disable=cell-var-from-loop
+        ])
+        record = measure(lambda: [data_type(**x) for x in rows]) ## pylint: disable=cell-var-from-loop
+        column = measure(lambda: ColumnTable.fromCsv( ## pylint: disable=cell-var-from-loop
+            path,
+            columns=data_type.COLUMNS,
+            int_columns=data_type.INT_COLUMNS,
+            float_columns=data_type.FLOAT_COLUMNS,
+            delimiter=delimiter,
+        ))
+        name = data_type.__name__
+        print(f"{name:<24}{len(rows):>8}{legacy[0]:>10.3f}{legacy[1]:>12}{record[0]:>10.3f}{record[1]:>12}{column[0]:>10.3f}{column[1]:>12}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else DATA)
@@ -0,0 +1,32 @@
+import hashlib
+import os
+
+from contextlib import contextmanager
+
+def fileHash(path, *, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+@contextmanager
+def replacing(path, *, suffix=".tmp"):
+    """Path of a temporary file to write, which replaces path once the block is done
+
+    The directory is made if needed. If the block fails the temporary file is
+    removed and path is left as it was, so a reader never sees a partial file.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + suffix
+    try:
+        yield tmp_path
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    os.replace(tmp_path, path)
@@ -0,0 +1,293 @@
+import csv
+
+from collections.abc import Sequence
+from functools import lru_cache
+
+import numpy as np
+
+## Code of a missing value in a categorical column
+MISSING = -1
+
+
+def toInt(val):
+    """Same coercion as Entry: strip thousands separators, keep the text if it isn't a number"""
+    if val is None or val == '':
+        return None
+
+    try:
+        return int(val.replace(',', ''))
+    except ValueError:
+        return val
+
+
+def toFloat(val):
+    if val is None or val == '':
+        return None
+
+    try:
+        return float(val.replace(',', ''))
+    except ValueError:
+        return val
+
+
+def toStr(val):
+    if val == '':
+        return None
+
+    return val
+
+
+class Column:
+    """One typed column. Numbers are stored in a numpy array with a mask of
+    missing values, anything else as an object array"""
+    def __init__(self, values, missing=None):
+        self.values  = values
+        self.missing = missing
+
+    @classmethod
+    def fromValues(cls, values, dtype=None):
+        """Build a column from already coerced python values"""
+        if dtype is not None:
+            missing = np.array([x is None for x in values], dtype=bool)
+            present = [x for x in values if x is not None]
+            if all(isinstance(x, (int, float)) for x in present):
+                array = np.zeros(len(values), dtype=dtype)
+                array[~missing] = present
+                return cls(array, missing)
+
+        ## Text, or a number column with some text in it
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return cls(array)
+
+    def __len__(self):
+        return len(self.values)
+
+    def objects(self):
+        """Values as an object array of python values, None where missing"""
+        if self.missing is None:
+            return self.values
+
+        array = self.values.astype(object)
+        array[self.missing] = None
+        return array
+
+    def get(self, i):
+        if self.missing is None:
+            return self.values[i]
+        if self.missing[i]:
+            return None
+
+        ## Hand back plain python numbers
+        return self.values[i].item()
+
+
+class Vocabulary:
+    """Interned strings, each with a small integer code"""
+    def __init__(self, values=()):
+        self.values = list(dict.fromkeys(values))
+        self.codes  = { x: i for i, x in enumerate(self.values) }
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        if value is None:
+            return MISSING
+
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+
+        return code
+
+    def encode(self, values):
+        return np.array([self.code(x) for x in values], dtype=np.int32)
+
+    def decode(self, codes):
+        return [None if x == MISSING else self.values[x] for x in codes]
+
+    def codesOf(self, values):
+        """Codes of the given values, leaving out any that never occur"""
+        return np.array([self.codes[x] for x in values if x in self.codes], dtype=np.int32)
+
+
+class CategoricalColumn:
+    """Low cardinality text column, stored as codes into a vocabulary
+
+    Seeding the vocabulary with the known values of a column, like the
+    property classes, gives those values the same codes in every table
+    """
+    def __init__(self, codes, vocabulary):
+        self.codes      = codes
+        self.vocabulary = vocabulary
+
+    @classmethod
+    def fromValues(cls, values, seed=()):
+        vocabulary = Vocabulary(seed)
+        return cls(vocabulary.encode(values), vocabulary)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def values(self):
+        array = np.empty(len(self.codes), dtype=object)
+        array[:] = self.vocabulary.decode(self.codes)
+        return array
+
+    def objects(self):
+        return self.values
+
+    def get(self, i):
+        code = self.codes[i]
+        if code == MISSING:
+            return None
+
+        return self.vocabulary.values[code]
+
+    def isIn(self, values):
+        """Mask of the rows holding one of the values"""
+        return np.isin(self.codes, self.vocabulary.codesOf(values))
+
+    def counts(self):
+        """Number of rows of each value"""
+        counts = np.bincount(self.codes[self.codes != MISSING], minlength=len(self.vocabulary))
+        return { x: int(n) for x, n in zip(self.vocabulary.values, counts) if n }
+
+
+class ColumnTable:
+    """A CSV/TSV file parsed into typed columns"""
+    def __init__(self, columns, length):
+        self.columns = columns
+        self.length  = length
+
+    @classmethod
+    def fromCsv(cls, path, *, columns=(), int_columns=(), float_columns=(), categorical_columns=None, delimiter=None):
+        """Parse a file into typed columns
+
+        categorical_columns maps text columns to store as codes to the values
+        to seed their vocabulary with
+        """
+        ## pylint: disable=too-many-locals
+        with open(path, 'r', encoding="utf-8-sig") as f:
+            reader = csv.reader(f) if delimiter is None else csv.reader(f, delimiter=delimiter)
+            header = next(reader)
+            raw = [[] for _ in header]
+            for row in reader:
+                ## Match DictReader, short rows are padded with None
+                for i, column in enumerate(raw):
+                    column.append(row[i] if i < len(row) else None)
+
+        int_columns   = set(int_columns)
+        float_columns = set(float_columns)
+        categorical_columns = categorical_columns or {}
+        length = len(raw[0]) if raw else 0
+        table = {}
+        for name, values in zip(header, raw):
+            if name in int_columns:
+                table[name] = Column.fromValues([toInt(x) for x in values], np.int64)
+            elif name in float_columns:
+                table[name] = Column.fromValues([toFloat(x) for x in values], np.float64)
+            elif name in categorical_columns:
+                table[name] = CategoricalColumn.fromValues([toStr(x) for x in values], categorical_columns[name])
+            else:
+                table[name] = Column.fromValues([toStr(x) for x in values])
+
+        ## Required columns that aren't in the file are all missing
+        for name in columns:
+            if name in table:
+                continue
+            if name in categorical_columns:
+                table[name] = CategoricalColumn.fromValues([None] * length, categorical_columns[name])
+            else:
+                table[name] = Column.fromValues([None] * length)
+
+        return cls(table, length)
+
+    def __len__(self):
+        return self.length
+
+    def __contains__(self, name):
+        return (name in self.columns)
+
+    def select(self, names):
+        """Table with only the given columns"""
+        return ColumnTable({ x: self.columns[x] for x in names }, self.length)
+
+    def isIn(self, name, values):
+        """Mask of the rows where a categorical column holds one of the values"""
+        return self.columns[name].isIn(values)
+
+    def counts(self, name):
+        return self.columns[name].counts()
+
+    def value(self, name, i):
+        return self.columns[name].get(i)
+
+    def row(self, i):
+        return { name: column.get(i) for name, column in self.columns.items() }
+
+
+class RowView:
+    """Entry backed by a row of a ColumnTable instead of its own attributes
+
+    The column slots of the Entry type are left unset, so reading one falls
+    through to __getattr__ and the table
+    """
+    __slots__ = ()
+
+    def __init__(self, table, row):
+        ## pylint: disable=super-init-not-called
+        object.__setattr__(self, '_table', table)
+        object.__setattr__(self, '_row', row)
+
+    def __getattr__(self, name):
+        if name in self._table:
+            return self._table.value(name, self._row)
+
+        raise AttributeError(name)
+
+    @property
+    def attrs(self):
+        return self._table.row(self._row)
+
+    def __reduce__(self):
+        ## Pickled views of one table share a single copy of it
+        return (_makeView, (self.ENTRY_TYPE, self._table, self._row))
+
+
+@lru_cache(maxsize=None)
+def makeViewType(data_type):
+    """Make a row view class that has all the methods of an Entry type"""
+    return type(f"{data_type.__name__}View", (RowView, data_type), { '__slots__': ('_table', '_row'), 'ENTRY_TYPE': data_type })
+
+
+def _makeView(data_type, table, row):
+    return makeViewType(data_type)(table, row)
+
+
+class RowViews(Sequence):
+    """Sequence of entries that are only created when accessed"""
+    def __init__(self, table, data_type):
+        self.table     = table
+        self.data_type = data_type
+        self.view_type = makeViewType(data_type)
+
+    def __reduce__(self):
+        ## The view type is made at runtime and can't be pickled by name
+        return (RowViews, (self.table, self.data_type))
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[x] for x in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+
+        return self.view_type(self.table, i)
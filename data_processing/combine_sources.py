@@ -0,0 +1,171 @@
+from collections import namedtuple
+
+import numpy as np
+
+import data_sources as ds
+from run_log import RunLog, logger
+from real_property import Property, Building
+
+## What's left over after combining the properties, besides the buildings
+Combined = namedtuple('Combined', ['count', 'missing_web', 'missing_gis', 'missing_building', 'assigned', 'mismatches'])
+
+## Position of the joined website and GIS entry of each main entry, -1 if
+## there's none, and the joined entries that don't agree with the main one
+Merged = namedtuple('Merged', ['website_idx', 'gis_idx', 'mismatches'])
+
+## A value of a joined entry that differs from the main entry. row is the
+## position of the main entry
+Mismatch = namedtuple('Mismatch', ['row', 'pid', 'source', 'column', 'main_value', 'value'])
+
+
+def makeBuildings(master_entries, *, log=None):
+    """Create the buildings of the master list entries
+
+    Returns all the buildings and a map of building ID to the building kept
+    for it. Later entries with the same ID are aliases or duplicates, and
+    are counted in log.
+    """
+    log = log or RunLog()
+    all_buildings = [Building.fromJson(x.toJson()) for x in master_entries]
+    building_map = {}
+    for b in all_buildings:
+        if b.id not in building_map:
+            building_map[b.id] = b
+        elif building_map[b.id].object_id != b.object_id:
+            log.event('alias', "Found an alias for building %s: %s", b.id, b.object_id)
+            building_map[b.id].addAlias(b)
+        else:
+            log.event('duplicate', "Dropping duplicate for building %s: %s", b.id, b.object_id)
+
+    return (all_buildings, building_map)
+
+
+def findBuildingId(entry, building_ids):
+    """ID of the building a combined entry belongs to, or None"""
+    if entry.building_id in building_ids:
+        return entry.building_id
+    if entry.buildingIdFromMapLot() in building_ids:
+        return entry.buildingIdFromMapLot()
+
+    return None
+
+
+def columnValues(source, name):
+    """Object array of a column, from a database's table if it has one or a list of entries"""
+    table = getattr(source, 'table', None)
+    if table is not None:
+        return table.columns[name].objects()
+
+    entries = getattr(source, 'entries', source)
+    array = np.empty(len(entries), dtype=object)
+    array[:] = [getattr(x, name) for x in entries]
+    return array
+
+
+def joinIndex(keys, db):
+    """Position in db of the entry for each key, -1 if it has none"""
+    by_pid = db.by_pid
+    return np.array([by_pid.get(x, -1) for x in keys], dtype=np.int64)
+
+
+def _findMismatches(pids, main_values, source, source_values, idx, column):
+    """Rows joined to an entry of source whose column doesn't agree with the main row"""
+    found = idx >= 0
+    bad = found & (main_values != source_values[np.where(found, idx, 0)])
+    return [Mismatch(i, pids[i], source, column, main_values[i], source_values[idx[i]]) for i in np.flatnonzero(bad).tolist()]
+
+
+def mergeSources(main_entries, website_db, gis_db):
+    """Join the website and GIS entries to the main entries on PID
+
+    Every PID and MapLot pair is checked at once, and all the rows that don't
+    agree are returned together instead of stopping at the first.
+    """
+    pids = np.empty(len(main_entries), dtype=object)
+    pids[:] = [x.getPropertyId() for x in main_entries]
+    main_pids = columnValues(main_entries, 'PID')
+    main_map_lots = columnValues(main_entries, 'MapLot')
+    website_idx = joinIndex(pids, website_db)
+    gis_idx = joinIndex(pids, gis_db)
+    checks = (
+        (website_db, 'website', website_idx, 'PropId',     main_pids),
+        (website_db, 'website', website_idx, 'MapLot',     main_map_lots),
+        (gis_db,     'gis',     gis_idx,     'PID',        main_pids),
+        (gis_db,     'gis',     gis_idx,     'PropertyID', main_map_lots),
+    )
+    mismatches = []
+    for db, source, idx, column, main_values in checks:
+        mismatches += _findMismatches(pids, main_values, source, columnValues(db, column), idx, column)
+
+    ## In row order, and in the order _selfValidate checks them within a row
+    return Merged(website_idx, gis_idx, sorted(mismatches, key=lambda x: x.row))
+
+
+def mismatchMessage(mismatch):
+    """Same message as CombinedEntry._selfValidate"""
+    kind = "Property IDs" if mismatch.column in ('PropId', 'PID') else "Building IDs"
+    return f"{kind} don't match. Found {mismatch.main_value} and {mismatch.source} {mismatch.value}"
+
+
+def combineProperties(main_entries, website_db, gis_db, building_map, *, drop_mismatched=False, log=None):
+    """Combine the sources of each main entry and add it to its building
+
+    Uses the main db as authoritative. The sources are joined and checked
+    by mergeSources first, and any mismatches are raised together, or with
+    drop_mismatched the entries that don't agree are left off their main
+    entry and only returned in mismatches.
+    assigned has the building ID given to each main entry, in order, None if
+    it has no building. Missing sources and buildings are counted in log.
+    """
+    log = log or RunLog()
+    merged = mergeSources(main_entries, website_db, gis_db)
+    if merged.mismatches and not drop_mismatched:
+        lines = [mismatchMessage(x) for x in merged.mismatches]
+        raise ValueError(f"Found {len(lines)} mismatched source entries:\n" + "\n".join(lines))
+
+    website_idxs = merged.website_idx.copy()
+    gis_idxs = merged.gis_idx.copy()
+    for m in merged.mismatches:
+        log.event('mismatch', "%s", mismatchMessage(m))
+        idx = website_idxs if m.source == 'website' else gis_idxs
+        idx[m.row] = -2 ## Found but not used
+
+    count = 0
+    missing_web = []
+    missing_gis = []
+    missing_building = []
+    assigned = []
+    for main_entry, website_idx, gis_idx in zip(main_entries, website_idxs.tolist(), gis_idxs.tolist()):
+        count += 1
+        entry = ds.CombinedEntry(main_entry)
+        logger.debug("Processing property %s: %s", entry.id, entry.address)
+
+        ## Website, already checked by mergeSources
+        if website_idx >= 0:
+            entry.website_entry = website_db.entries[website_idx]
+        elif website_idx == -1:
+            log.event('missing_web', "Property %s missing website data", entry.id)
+            missing_web.append(entry.id)
+
+        ## GID
+        if gis_idx >= 0:
+            entry.gis_entry = gis_db.entries[gis_idx]
+        elif gis_idx == -1:
+            log.event('missing_gis', "Property %s missing GIS data", entry.id)
+            missing_gis.append(entry.id)
+
+        ## Building
+        building_id = findBuildingId(entry, building_map)
+        assigned.append(building_id)
+        if building_id is None:
+            log.event('missing_building', "Property %s has no building. Couldn't find %s", entry.id, entry.building_id)
+            missing_building.append(entry)
+            continue
+
+        building = building_map[building_id]
+        if entry.isBuilding():
+            building.setMainEntry(entry)
+        else:
+            building.addProperty(Property.fromJson(entry.toJson()))
+
+    return Combined(count, missing_web, missing_gis, missing_building, assigned, merged.mismatches)
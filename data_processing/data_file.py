@@ -0,0 +1,92 @@
+"""Line delimited output of process_all_sources.py
+
+Each line is one JSON record, {"kind": ..., "value": ...}, with the kinds in
+the order of KINDS: every building, then every rouge property, then each PID
+missing from the website and from the GIS data. Within a kind, records are
+sorted by ID. The file can be written as the records are produced and read
+back one line at a time, so neither end holds the whole output.
+"""
+
+import json
+
+from cache_utils import replacing
+
+## Record kind -> key of the list it comes from in the output data
+KINDS = {
+    'building':       'buildings',
+    'rouge_property': 'rouge_properties',
+    'missing_web':    'missing_web',
+    'missing_gis':    'missing_gis',
+}
+KIND_ORDER = { x: i for i, x in enumerate(KINDS) }
+
+
+def recordKey(kind, value):
+    """Position of a record in a file"""
+    return (KIND_ORDER[kind], value['id'] if isinstance(value, dict) else value)
+
+
+def outputRecords(buildings, rouge_properties, missing_web, missing_gis):
+    """Records of the output in file order
+
+    Each building and property is only turned into JSON as its record is
+    written.
+    """
+    for b in sorted(buildings, key=lambda x: x.id):
+        yield ('building', b.toJson())
+    for x in sorted(rouge_properties, key=lambda x: x.id):
+        yield ('rouge_property', x.toJson())
+    for pid in sorted(missing_web):
+        yield ('missing_web', pid)
+    for pid in sorted(missing_gis):
+        yield ('missing_gis', pid)
+
+
+def writeRecords(path, records):
+    """Write records one line at a time, returns how many there were
+
+    The file is only replaced once every record is written.
+    """
+    count = 0
+    with replacing(path) as tmp_path, open(tmp_path, 'w') as f:
+        for kind, value in records:
+            f.write(json.dumps({ 'kind': kind, 'value': value }, sort_keys=True))
+            f.write("\n")
+            count += 1
+
+    return count
+
+
+def readRecords(path):
+    """(kind, value) of each record, as the file is read"""
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            yield (record['kind'], record['value'])
+
+
+def readBuildings(path):
+    """Each building, stopping at the end of the buildings"""
+    for kind, value in readRecords(path):
+        if kind != 'building':
+            return
+
+        yield value
+
+
+def readData(path):
+    """The whole output, in the same form as the data it was written from"""
+    data = { x: [] for x in KINDS.values() }
+    for kind, value in readRecords(path):
+        data[KINDS[kind]].append(value)
+
+    return data
+
+
+class Buildings:
+    """Buildings of a file, read again on each pass for code that goes over them more than once"""
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        return readBuildings(self.path)
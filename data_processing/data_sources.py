@@ -1,6 +1,11 @@
 import csv
 
 from collections import defaultdict
+from functools import lru_cache
+from operator import attrgetter
+
+import constants as cnts
+from columnar import ColumnTable, RowViews, toFloat, toInt, toStr
 
 MAIN_COLUMNS = (
     'PID',
@@ -50,6 +55,22 @@ MAIN_FLOAT_COLUMNS = (
     'Exterior_NumStories',
 )
 
+## Low cardinality columns, stored as codes in columnar mode. Each maps to the
+## known values its vocabulary starts with. The source cache keeps them
+## dictionary encoded, so entries loaded from it share one string per value
+MAIN_CATEGORICAL_COLUMNS = {
+    'PropertyClass':               cnts.PROPERTY_CLASS,
+    'Zoning':                      cnts.ALL_ZONES,
+    'Owner_City':                  (),
+    'Owner_State':                 (),
+    'Exterior_Style':              (),
+    'Exterior_Occupancy':          (),
+    'Exterior_View':               (),
+    'Condition_InteriorCondition': (),
+    'Condition_OverallCondition':  (),
+    'Condition_OverallGrade':      (),
+}
+
 WEBSITE_COLUMNS = (
     'PropId',
     'lblAddress',
@@ -88,6 +109,16 @@ WEBSITE_INT_COLUMNS = (
     'FirstFloor_GrossArea',
 )
 
+WEBSITE_CATEGORICAL_COLUMNS = {
+    'PropertyClass':    cnts.PROPERTY_CLASS,
+    'Zoning':           cnts.ALL_ZONES,
+    'TaxDistrict':      (),
+    'Style':            (),
+    'Occupancy':        (),
+    'OverallCondition': (),
+    'OverallGrade':     (),
+}
+
 MASTER_LIST_COLUMNS = (
     'OBJECTID',
     'address_id',
@@ -127,6 +158,14 @@ MASTER_LIST_FLOAT_COLUMNS = (
     'lat',
 )
 
+MASTER_LIST_CATEGORICAL_COLUMNS = {
+    'TYPE':         (),
+    'Zip_Code':     (),
+    'Neighborhood': cnts.NEIGHBORHOODS,
+    'Ward':         (),
+    'Precinct':     (),
+}
+
 GIS_COLUMNS = (
     'PropertyID',
     'PID',
@@ -142,39 +181,93 @@ GIS_INT_COLUMNS = (
     'LivingArea',
 )
 
+GIS_CATEGORICAL_COLUMNS = {
+    'LandUse': (),
+}
+
+
+def compileInit(columns, int_columns=(), float_columns=()):
+    """Generate an __init__ that sets and coerces every column of a schema
+
+    The coercion for each column is decided once here, so loading a row is
+    a straight run of assignments rather than loops over the column lists
+    """
+    int_columns   = set(int_columns)
+    float_columns = set(float_columns)
+    lines = ["def __init__(self, **attrs):", "    get = attrs.get"]
+    for name in columns:
+        if name in int_columns:
+            convert = 'toInt'
+        elif name in float_columns:
+            convert = 'toFloat'
+        else:
+            convert = 'toStr'
+
+        lines.append(f"    self.{name} = {convert}(get({name!r}))")
+
+    namespace = { 'toInt': toInt, 'toFloat': toFloat, 'toStr': toStr }
+    exec("\n".join(lines), namespace) ## pylint: disable=exec-used
+    return namespace['__init__']
+
+
+def compileFromTuples(columns):
+    """Generate a function that makes entries from tuples of typed values in column order"""
+    targets = ", ".join(f"entry.{x}" for x in columns)
+    lines = [
+        "def fromTuples(cls, rows):",
+        "    entries = []",
+        "    for row in rows:",
+        "        entry = new(cls)",
+        f"        {targets}, = row",
+        "        entries.append(entry)",
+        "    return entries",
+    ]
+    namespace = { 'new': object.__new__ }
+    exec("\n".join(lines), namespace) ## pylint: disable=exec-used
+    return namespace['fromTuples']
+
+
+@lru_cache(maxsize=None)
+def projectedInit(data_type, columns):
+    """__init__ of an entry type that only sets and coerces the given columns"""
+    for name in columns:
+        if name not in data_type.COLUMNS:
+            raise ValueError(f"{data_type.__name__} has no column {name}")
+
+    return compileInit(columns, data_type.INT_COLUMNS, data_type.FLOAT_COLUMNS)
+
+
 class Entry:
-    def __init__(self, attrs, required_columns=None, int_columns=None, float_columns=None):
-        self.attrs = dict(attrs or {}) ## Copy
-        required_columns = required_columns or []
-        int_columns      = int_columns      or []
-        float_columns    = float_columns    or []
-
-        ## Fix missing
-        for key in required_columns:
-            if key not in self.attrs:
-                self.attrs[key] = None
-
-        ## Fix numbers
-        for key in int_columns:
-            try:
-                if self.attrs[key] is not None:
-                    self.attrs[key] = int(self.attrs[key].replace(',', ''))
-            except ValueError:
-                pass
+    """Base of the record types. Each subclass lists its columns in __slots__
+    and COLUMNS, and gets an __init__ generated from its schema. Columns that
+    aren't in the schema are dropped."""
+    __slots__ = ()
+
+    ## Column schema
+    COLUMNS             = ()
+    INT_COLUMNS         = ()
+    FLOAT_COLUMNS       = ()
+    CATEGORICAL_COLUMNS = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        ## Only for classes that declare a schema, not for row views
+        if 'COLUMNS' in cls.__dict__:
+            cls.__init__ = compileInit(cls.COLUMNS, cls.INT_COLUMNS, cls.FLOAT_COLUMNS)
+            cls.fromTuples = classmethod(compileFromTuples(cls.COLUMNS))
 
-        for key in float_columns:
-            try:
-                if self.attrs[key] is not None:
-                    self.attrs[key] = float(self.attrs[key].replace(',', ''))
-            except ValueError:
-                pass
-
-        ## Set attributes
-        for attr, val in self.attrs.items():
-            if val == '':
-                setattr(self, attr, None)
-            else:
-                setattr(self, attr, val)
+    @property
+    def attrs(self):
+        return { x: getattr(self, x) for x in self.COLUMNS }
+
+    @classmethod
+    def toTuples(cls, entries):
+        """Typed values of each entry in column order, undone by fromTuples"""
+        get = attrgetter(*cls.COLUMNS)
+        if len(cls.COLUMNS) == 1:
+            return [(get(x),) for x in entries]
+
+        return [get(x) for x in entries]
 
     def getPropertyId(self):
         ## pylint: disable=no-self-use
@@ -198,8 +291,11 @@ class Entry:
 
 
 class MainDatabaseEntry(Entry):
-    def __init__(self, **attrs):
-        Entry.__init__(self, attrs, MAIN_COLUMNS, MAIN_INT_COLUMNS, MAIN_FLOAT_COLUMNS)
+    __slots__           = MAIN_COLUMNS
+    COLUMNS             = MAIN_COLUMNS
+    INT_COLUMNS         = MAIN_INT_COLUMNS
+    FLOAT_COLUMNS       = MAIN_FLOAT_COLUMNS
+    CATEGORICAL_COLUMNS = MAIN_CATEGORICAL_COLUMNS
 
     def getPropertyId(self):
         if self.PID is None:
@@ -218,8 +314,10 @@ class MainDatabaseEntry(Entry):
 
 
 class WebsiteDatabaseEntry(Entry):
-    def __init__(self, **attrs):
-        Entry.__init__(self, attrs, WEBSITE_COLUMNS, WEBSITE_INT_COLUMNS)
+    __slots__           = WEBSITE_COLUMNS
+    COLUMNS             = WEBSITE_COLUMNS
+    INT_COLUMNS         = WEBSITE_INT_COLUMNS
+    CATEGORICAL_COLUMNS = WEBSITE_CATEGORICAL_COLUMNS
 
     def getPropertyId(self):
         return self.PropId
@@ -238,8 +336,11 @@ class WebsiteDatabaseEntry(Entry):
 
 
 class MasterListEntry(Entry):
-    def __init__(self, **attrs):
-        Entry.__init__(self, attrs, MASTER_LIST_COLUMNS, MASTER_LIST_INT_COLUMNS, MASTER_LIST_FLOAT_COLUMNS)
+    __slots__           = MASTER_LIST_COLUMNS
+    COLUMNS             = MASTER_LIST_COLUMNS
+    INT_COLUMNS         = MASTER_LIST_INT_COLUMNS
+    FLOAT_COLUMNS       = MASTER_LIST_FLOAT_COLUMNS
+    CATEGORICAL_COLUMNS = MASTER_LIST_CATEGORICAL_COLUMNS
 
     @property
     def Block(self):
@@ -292,8 +393,10 @@ class MasterListEntry(Entry):
 
 
 class GisEntry(Entry):
-    def __init__(self, **attrs):
-        Entry.__init__(self, attrs, GIS_COLUMNS, GIS_INT_COLUMNS)
+    __slots__           = GIS_COLUMNS
+    COLUMNS             = GIS_COLUMNS
+    INT_COLUMNS         = GIS_INT_COLUMNS
+    CATEGORICAL_COLUMNS = GIS_CATEGORICAL_COLUMNS
 
     def getPropertyId(self):
         return self.PID
@@ -463,16 +566,81 @@ class CombinedEntry:
                 raise ValueError(f"Building IDs don't match. Found {self.main_entry.MapLot} and gis {self.gis_entry.PropertyID}")
 
 
+def _streamEntries(path, data_type, init, where, delimiter):
+    with open(path, 'r', encoding="utf-8-sig") as f:
+        reader = None
+        if delimiter is None:
+            reader = csv.DictReader(f)
+        else:
+            reader = csv.DictReader(f, delimiter=delimiter)
+
+        for row in reader:
+            entry = data_type.__new__(data_type)
+            try:
+                init(entry, **row)
+            except Exception as e:
+                print(f"Error while processing {data_type} entry:", row)
+                raise(e)
+
+            if where is None or where(entry):
+                yield entry
+
+
+## Database index -> Entry method giving its key
+INDEX_KEYS = {
+    'by_pid':         'getPropertyId',
+    'by_map_lot':     'getMapLot',
+    'by_building_id': 'getBuildingId', ## Several entries per key
+}
+
+
 class Database:
-    def __init__(self, path, data_type, *, delimiter=None, verbose=False):
+    ## Entry type and delimiter of the files the subclasses load
+    DATA_TYPE = None
+    DELIMITER = None
+
+    def __init__(self, path, data_type, *, delimiter=None, verbose=False, columnar=False, cache_dir=None):
+        """Load a CSV/TSV file of entries
+
+        In columnar mode the file is parsed into typed columns and entries are
+        row views that are only created when accessed. Either way the indexes
+        hold positions into self.entries, and each is only built the first
+        time it's used.
+
+        With a cache_dir, the parsed and typed table is saved there as parquet
+        and reused until the source file changes, see source_cache. Outside
+        columnar mode the entries are made straight from its arrays.
+        """
         self.path = path
+        self.data_type = data_type
+        self.table = None
         self.entries = []
-        self.by_pid = {}
-        self.by_map_lot = {}
-        self.by_building_id = defaultdict(list)
+        self._indexes = {}
         if verbose:
             print(f"Loading {path}")
 
+        if cache_dir is not None:
+            ## pyarrow is only needed when caching
+            import source_cache ## pylint: disable=import-outside-toplevel
+            if not columnar:
+                self.entries = source_cache.loadEntries(path, data_type, cache_dir, delimiter=delimiter)
+                return
+
+            self.table = source_cache.loadTable(path, data_type, cache_dir, delimiter=delimiter)
+        elif columnar:
+            self.table = ColumnTable.fromCsv(
+                path,
+                columns=data_type.COLUMNS,
+                int_columns=data_type.INT_COLUMNS,
+                float_columns=data_type.FLOAT_COLUMNS,
+                categorical_columns=data_type.CATEGORICAL_COLUMNS,
+                delimiter=delimiter,
+            ).select(data_type.COLUMNS)
+
+        if self.table is not None:
+            self.entries = RowViews(self.table, data_type)
+            return
+
         with open(path, 'r', encoding="utf-8-sig") as f:
             reader = None
             if delimiter is None:
@@ -482,17 +650,77 @@ class Database:
 
             for row in reader:
                 try:
-                    entry = data_type(**row)
-                    self.entries.append(entry)
-                    self.by_pid[entry.getPropertyId()] = entry
-                    self.by_map_lot[entry.getMapLot()] = entry
-                    self.by_building_id[entry.getBuildingId()].append(entry)
+                    self.entries.append(data_type(**row))
                 except Exception as e:
                     print(f"Error while processing {data_type} entry:", row)
                     raise(e)
 
+    @classmethod
+    def stream(cls, path, *, columns=None, where=None, data_type=None, delimiter=None):
+        """Yield the entries of a file one row at a time, without keeping any
+
+        columns limits the entries to those columns, reading any other one
+        raises AttributeError. where is a function of an entry, only entries
+        it returns true for are yielded. It can only read the given columns.
+        """
+        data_type = data_type or cls.DATA_TYPE
+        delimiter = delimiter or cls.DELIMITER
+        ## Checked here rather than on the first row
+        init = data_type.__init__ if columns is None else projectedInit(data_type, tuple(columns))
+        return _streamEntries(path, data_type, init, where, delimiter)
+
+    def _index(self, name):
+        if name not in self._indexes:
+            self._indexes[name] = self._buildIndex(name)
+
+        return self._indexes[name]
+
+    def _buildIndex(self, name):
+        get_key = getattr(self.data_type, INDEX_KEYS[name])
+        index = defaultdict(list) if name == 'by_building_id' else {}
+        for i, entry in enumerate(self.entries):
+            try:
+                key = get_key(entry)
+            except Exception as e:
+                print(f"Error while indexing {self.data_type} entry:", entry.attrs)
+                raise(e)
+
+            if name == 'by_building_id':
+                index[key].append(i)
+            else:
+                index[key] = i
+
+        return index
+
+    @property
+    def by_pid(self):
+        return self._index('by_pid')
+
+    @property
+    def by_map_lot(self):
+        return self._index('by_map_lot')
+
+    @property
+    def by_building_id(self):
+        return self._index('by_building_id')
+
+    def __getstate__(self):
+        ## Rebuilding slotted entries one attribute at a time is most of the
+        ## cost of unpickling, send them as tuples instead
+        state = dict(self.__dict__)
+        if isinstance(self.entries, list):
+            state['entries'] = self.data_type.toTuples(self.entries)
+
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state['entries'], list):
+            state['entries'] = state['data_type'].fromTuples(state['entries'])
+
+        self.__dict__.update(state)
+
     def __getitem__(self, key):
-        return self.by_pid[key]
+        return self.entries[self.by_pid[key]]
 
     def __contains__(self, key):
         return (key in self.by_pid)
@@ -500,28 +728,41 @@ class Database:
     def __iter__(self):
         return iter(self.entries)
 
+    def __len__(self):
+        return len(self.entries)
+
 
 class MainDatabase(Database):
+    DATA_TYPE = MainDatabaseEntry
+
     def __init__(self, path, **kwargs):
-        Database.__init__(self, path, MainDatabaseEntry, **kwargs)
+        Database.__init__(self, path, self.DATA_TYPE, delimiter=self.DELIMITER, **kwargs)
 
 
 class WebsiteDatabase(Database):
+    DATA_TYPE = WebsiteDatabaseEntry
+    DELIMITER = "\t"
+
     def __init__(self, path, **kwargs):
-        Database.__init__(self, path, WebsiteDatabaseEntry, delimiter="\t", **kwargs)
+        Database.__init__(self, path, self.DATA_TYPE, delimiter=self.DELIMITER, **kwargs)
 
 
 class GisDatabase(Database):
+    DATA_TYPE = GisEntry
+    DELIMITER = "\t"
+
     def __init__(self, path, **kwargs):
-        Database.__init__(self, path, GisEntry, delimiter="\t", **kwargs)
+        Database.__init__(self, path, self.DATA_TYPE, delimiter=self.DELIMITER, **kwargs)
 
 
 class MasterDatabase(Database):
+    DATA_TYPE = MasterListEntry
+
     def __init__(self, path, **kwargs):
-        Database.__init__(self, path, MasterListEntry, **kwargs)
+        Database.__init__(self, path, self.DATA_TYPE, delimiter=self.DELIMITER, **kwargs)
 
     def __getitem__(self, key):
-        return self.by_building_id[key]
+        return [self.entries[x] for x in self.by_building_id[key]]
 
     def __contains__(self, key):
         return (key in self.by_building_id)
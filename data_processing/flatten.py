@@ -1,8 +1,8 @@
 #!/usr/bin/python3
 
-import json
 import os
 
+import data_file
 import gis
 
 import constants as cnts
@@ -11,18 +11,14 @@ ROOT      = "/home/charles/Projects/cambridge_property_db/"
 GEOJSON   = os.path.join(ROOT, "geojson")
 STATS     = os.path.join(ROOT, "stats")
 lots_path = os.path.join(GEOJSON,"ASSESSING_ParcelsFY2023.geojson")
-data_path = os.path.join(ROOT, "all_data.json")
+data_path = os.path.join(ROOT, "all_data.ndjson")
 out_path  = os.path.join(STATS, "lots_all.csv")
-lot_gis   = gis.Lots(lots_path)
+lot_gis   = gis.Lots(lots_path, index_only=True)
 
 
 ZONES = None #cnts.ZONES_RES + cnts.ZONES_BIZ_LOW
 NO_BLOCKS = cnts.FIRST_ST
 
-js = None
-with open(data_path) as f:
-    js = json.load(f)
-
 keys = (
     'street_name',
     'street_number',
@@ -45,7 +41,7 @@ columns = ('id', 'ML') + keys + (
 )
 
 rows = [columns]
-for b in js['buildings']:
+for b in data_file.readBuildings(data_path):
     if ZONES and b['zone'] not in ZONES:
         continue
 
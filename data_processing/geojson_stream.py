@@ -0,0 +1,73 @@
+import json
+import re
+
+## Finds the start of the features array in a FeatureCollection
+FEATURES_RE = re.compile(r'"features"\s*:\s*\[')
+WHITESPACE  = " \t\n\r,"
+
+
+def iterFeatures(path, *, chunk_size=1 << 20):
+    """Yield the features of a geojson FeatureCollection one at a time
+
+    The file is read in chunks and each feature is decoded on its own, so
+    memory use is bounded by the largest single feature rather than the
+    whole file
+    """
+    decoder = json.JSONDecoder()
+    with open(path) as f:
+        buf = ""
+        eof = False
+
+        def readMore(size):
+            nonlocal buf, eof
+            data = f.read(size)
+            eof = not data
+            buf += data
+
+        ## Skip ahead to the features array
+        while True:
+            match = FEATURES_RE.search(buf)
+            if match is not None:
+                buf = buf[match.end():]
+                break
+            if eof:
+                raise ValueError(f"No features found in {path}")
+
+            ## Keep a tail in case the key is split across chunks
+            buf = buf[-32:]
+            readMore(chunk_size)
+
+        ## Decode one feature at a time
+        pos = 0
+        read_size = chunk_size
+        while True:
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+
+            if pos == len(buf):
+                if eof:
+                    raise ValueError(f"Unexpected end of file in {path}")
+
+                buf, pos = buf[pos:], 0
+                readMore(chunk_size)
+                continue
+
+            if buf[pos] == ']':
+                return
+
+            try:
+                feature, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                ## Most likely a partial feature, read more and try again.
+                ## Grow the reads so a huge feature isn't decoded many times.
+                if eof:
+                    raise
+
+                buf, pos = buf[pos:], 0
+                readMore(read_size)
+                read_size *= 2
+                continue
+
+            read_size = chunk_size
+            pos = end
+            yield feature
@@ -1,42 +1,271 @@
 import json
-from shapely.geometry import shape, Point
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping, shape, Point
+from shapely.strtree import STRtree
+
+import gis_grid
+import gis_store
+from cache_utils import fileHash
+from geojson_stream import iterFeatures
+
+
+class GeometryIndex:
+    """Spatial index over a list of polygons
+
+    Results are indices into the original list, in original order, so that
+    callers get the same answer as a linear scan
+    """
+    def __init__(self, geometries):
+        self.geometries = list(geometries)
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def query(self, point):
+        ## The predicate is evaluated as point.within(polygon), which is the
+        ## same as polygon.contains(point), but only on bounding box candidates
+        return sorted(int(x) for x in self.tree.query(point, predicate='within'))
+
+    def queryMany(self, points):
+        """Find the first containing polygon for each row of an Nx2 lon/lat array
+
+        Returns an integer array of indices, with -1 where nothing was found
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        found = np.full(len(points), -1, dtype=np.int64)
+        if not len(points):
+            return found
+
+        point_idx, geom_idx = self.tree.query(shapely.points(points), predicate='within')
+        ## Keep the lowest polygon index per point, same as the single lookup
+        order = np.lexsort((geom_idx, point_idx))
+        point_idx, geom_idx = point_idx[order], geom_idx[order]
+        first = np.unique(point_idx, return_index=True)[1]
+        found[point_idx[first]] = geom_idx[first]
+        return found
+
 
 class GisGeoJson:
-    def __init__(self, path, *, secondary_id_key=None):
-        self.geojson          = None
+    def __init__(self, path, *, secondary_id_key=None, use_sidecar=True, index_only=False, properties=None, keep_geometry=True,
+            grid_boundary=None, grid_resolution=gis_grid.RESOLUTION):
+        """Load a geojson layer
+
+        If properties is given, only those properties (plus the secondary ID)
+        are kept for each feature. With keep_geometry off the coordinates are
+        dropped as soon as each feature is parsed. Either option streams the
+        file instead of loading it whole.
+
+        If grid_boundary is the path of a boundary layer, single point lookups
+        go through a raster grid over its extent first, see gis_grid.
+        """
+        self.path             = path
         self.secondary_id_key = secondary_id_key
+        self.index_only       = index_only
+        self.keep_geometry    = keep_geometry
+        self.properties       = None
         self.id_to_secondary  = {}
         self.secondary_to_id  = {}
         self.features         = {}
-        with open(path) as f:
-            self.geojson = json.load(f)
+        self._geojson         = None
+        self._feature_list    = []
+        self._geometries      = None
+        self._sidecar         = None
+        self._index           = None
+        self.grid_boundary    = grid_boundary
+        self.grid_resolution  = grid_resolution
+        self._grid            = None
+
+        if properties is not None:
+            self.properties = list(properties)
+            if secondary_id_key is not None and secondary_id_key not in self.properties:
+                self.properties.append(secondary_id_key)
+
+        if index_only:
+            self._loadIdIndex(use_sidecar)
+            return
 
-        self.features = { x['id']: x for x in self.geojson['features'] }
+        ## Prefer the binary sidecar if it's up to date
+        store_path = gis_store.sidecarPath(path)
+        if use_sidecar and gis_store.isFresh(path, store_path):
+            self._sidecar = gis_store.Sidecar(store_path)
+            self._feature_list = [
+                { 'type': 'Feature', 'id': geo_id, 'properties': self._pruneProperties(props) }
+                for geo_id, props in zip(self._sidecar.ids, self._sidecar.properties)
+            ]
+        elif self.properties is not None or not keep_geometry:
+            self._streamFeatures()
+        else:
+            with open(path) as f:
+                self._geojson = json.load(f)
+
+            self._feature_list = self._geojson['features']
+
+        self.features = { x['id']: x for x in self._feature_list }
         if self.secondary_id_key is not None:
-            for feature in self.geojson['features']:
+            for feature in self._feature_list:
                 sec_id = feature['properties'][self.secondary_id_key]
                 geo_id = feature['id']
                 self.secondary_to_id[sec_id] = geo_id
                 self.id_to_secondary[geo_id] = sec_id
 
+    def _pruneProperties(self, props):
+        if self.properties is None:
+            return props
+
+        return { key: props.get(key) for key in self.properties }
+
+    def _streamFeatures(self):
+        """Parse one feature at a time, keeping only what was asked for
+
+        Geometries are kept as shapely objects rather than nested coordinate lists
+        """
+        geometries = []
+        for feature in iterFeatures(self.path):
+            self._feature_list.append({
+                'type':       'Feature',
+                'id':         feature['id'],
+                'properties': self._pruneProperties(feature['properties']),
+            })
+            if self.keep_geometry:
+                geometries.append(shape(feature['geometry']))
+
+        if self.keep_geometry:
+            self._geometries = geometries
+
+    def _loadIdIndex(self, use_sidecar):
+        """Only load the ID maps, streaming the file if there's no ID sidecar"""
+        key = self.secondary_id_key
+        if key is None:
+            raise ValueError("Index only mode needs a secondary_id_key")
+
+        if use_sidecar and gis_store.isFresh(self.path, gis_store.idIndexPath(self.path, key)):
+            ids, secondary_ids = gis_store.readIdIndex(self.path, key)
+        else:
+            ids, secondary_ids = [], []
+            for feature in iterFeatures(self.path):
+                ids.append(feature['id'])
+                secondary_ids.append(feature['properties'][key])
+
+            if use_sidecar:
+                gis_store.writeIdIndex(self.path, key, ids, secondary_ids)
+
+        for geo_id, sec_id in zip(ids, secondary_ids):
+            self.secondary_to_id[sec_id] = geo_id
+            self.id_to_secondary[geo_id] = sec_id
+
+    @property
+    def geojson(self):
+        """The layer as a geojson dict, rebuilding geometries from the sidecar if needed"""
+        if self.index_only or not self.keep_geometry:
+            raise ValueError(f"{self.path} was loaded without geometries")
+
+        if self._geojson is None:
+            for feature, geometry in zip(self._feature_list, self.index.geometries):
+                feature['geometry'] = mapping(geometry)
+
+            self._geojson = { 'type': 'FeatureCollection', 'features': self._feature_list }
+
+        return self._geojson
+
+    @property
+    def index(self):
+        """Lazily build the spatial index on first lookup"""
+        if self.index_only or not self.keep_geometry:
+            raise ValueError(f"{self.path} was loaded without geometries")
+
+        if self._index is None:
+            if self._geometries is not None:
+                geometries = self._geometries
+                self._geometries = None
+            elif self._sidecar is not None:
+                geometries = self._sidecar.geometries()
+            else:
+                geometries = [shape(x['geometry']) for x in self._feature_list]
+
+            self._index = GeometryIndex(geometries)
+
+        return self._index
+
+    @property
+    def grid(self):
+        """Lazily load or build the raster grid, None if not enabled"""
+        if self.grid_boundary is None:
+            return None
+
+        if self._grid is None:
+            ## The grid depends on both layers and the resolution
+            source_hash = f"{fileHash(self.path)}:{fileHash(self.grid_boundary)}"
+            grid_path = gis_grid.gridPath(self.path)
+            self._grid = gis_grid.GridIndex.load(grid_path, source_hash, self.grid_resolution)
+            if self._grid is None:
+                boundary = GisGeoJson(self.grid_boundary, properties=())
+                bounds = shapely.total_bounds(boundary.index.geometries)
+                self._grid = gis_grid.GridIndex.build(self.index, bounds, self.grid_resolution)
+                self._grid.save(grid_path, source_hash)
+
+        return self._grid
+
+    def _findFirst(self, points):
+        """Index of the first feature containing each point, -1 if none"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if self.grid is None:
+            return self.index.queryMany(points)
+
+        ## Only points in boundary cells need an exact test
+        found = self.grid.lookup(points)
+        exact = found == gis_grid.BOUNDARY
+        found[exact] = self.index.queryMany(points[exact])
+        return found
+
     def findAllFeatures(self, point):
         if not isinstance(point, Point):
             point = Point(point)
 
-        found = []
-        for feature in self.geojson['features']:
-            polygon = shape(feature['geometry'])
-            if polygon.contains(point):
-                found.append(feature)
-
-        return found
+        return [self._feature_list[i] for i in self.index.query(point)]
 
     def findFeature(self, point):
-        found = self.findAllFeatures(point)
-        if not found:
+        if isinstance(point, Point):
+            point = (point.x, point.y)
+
+        found = self._findFirst(point)[0]
+        if found < 0:
             return None
 
-        return found[0]
+        return self._feature_list[found]
+
+    def findFeatures(self, points):
+        """Vectorized findFeature over an Nx2 lon/lat array"""
+        features = self._feature_list
+        return [features[i] if i >= 0 else None for i in self._findFirst(points)]
+
+    def findValues(self, points, key):
+        """Look up a property of the containing feature for every point
+
+        Returns an object array so values stay plain python types
+        """
+        return self._indexValues(self._findFirst(points), key)
+
+    def _indexValues(self, found, key):
+        ## A miss is -1, which picks up the trailing None
+        values = np.array(self.featureValues(key) + [None], dtype=object)
+        return values[found]
+
+    def featureValues(self, key):
+        """The value of a property for every feature, in file order"""
+        return [x['properties'][key] for x in self._feature_list]
+
+    def toWkb(self, key):
+        """Compact form of the layer: WKB geometries and the value of key for each"""
+        if self._sidecar is not None:
+            wkbs = self._sidecar.wkbs()
+        else:
+            wkbs = shapely.to_wkb(self.index.geometries).tolist()
+
+        return (wkbs, self.featureValues(key))
 
     def getGeoId(self, sec_id):
         if sec_id not in self.secondary_to_id:
@@ -53,20 +282,39 @@ class GisGeoJson:
 
 
 class ZoningDistricts(GisGeoJson):
-    def __init__(self, path):
-        GisGeoJson.__init__(self, path, secondary_id_key='ZONE_TYPE')
+    def __init__(self, path, **kwargs):
+        GisGeoJson.__init__(self, path, secondary_id_key='ZONE_TYPE', **kwargs)
+        self.overlay = None
+
+    def setOverlay(self, overlay):
+        """Use a gis_overlay.BlockZoneOverlay for lookups with a known block"""
+        self.overlay = overlay
+
+    def findZone(self, point, *, block=None):
+        if isinstance(point, Point):
+            point = (point.x, point.y)
+
+        if block is not None and self.overlay is not None:
+            return self.findZones([point], blocks=[block])[0]
 
-    def findZone(self, point):
         found = self.findFeature(point)
         if not found:
             return None
 
         return found['properties']['ZONE_TYPE']
 
+    def findZones(self, points, *, blocks=None):
+        """Zone of every point. If the block of each point is known, only that
+        block's candidate zones are tested"""
+        if blocks is None or self.overlay is None:
+            return self.findValues(points, 'ZONE_TYPE')
+
+        return self._indexValues(self.overlay.findFirst(self, points, blocks), 'ZONE_TYPE')
+
 
 class CityBlocks(GisGeoJson):
-    def __init__(self, path):
-        GisGeoJson.__init__(self, path, secondary_id_key='UNQ_ID')
+    def __init__(self, path, **kwargs):
+        GisGeoJson.__init__(self, path, secondary_id_key='UNQ_ID', **kwargs)
 
     def findBlock(self, point):
         found = self.findFeature(point)
@@ -75,6 +323,9 @@ class CityBlocks(GisGeoJson):
 
         return found['properties']['UNQ_ID']
 
+    def findBlocks(self, points):
+        return self.findValues(points, 'UNQ_ID')
+
 class Lots(GisGeoJson):
-    def __init__(self, path):
-        GisGeoJson.__init__(self, path, secondary_id_key='ML')
+    def __init__(self, path, **kwargs):
+        GisGeoJson.__init__(self, path, secondary_id_key='ML', **kwargs)
@@ -0,0 +1,96 @@
+import os
+import sqlite3
+
+from collections import defaultdict
+
+import gis_search
+from cache_utils import fileHash
+from gis_search import locationKey, keyLocations, pointsOf
+
+
+class AssignmentCache:
+    """On disk cache of location -> feature value for each GIS layer
+
+    Each layer is tagged with the content hash of its geojson file. When the
+    file changes, only that layer's entries are dropped.
+    """
+    def __init__(self, path):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS layers (name TEXT PRIMARY KEY, hash TEXT)")
+            ## No type on value so ints and strings round trip as is
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS assignments (
+                    layer TEXT, lon INTEGER, lat INTEGER, value,
+                    PRIMARY KEY (layer, lon, lat)
+                ) WITHOUT ROWID
+            """)
+
+    def useLayer(self, name, file_hash):
+        """Register the current hash of a layer, dropping stale entries"""
+        row = self.conn.execute("SELECT hash FROM layers WHERE name = ?", (name,)).fetchone()
+        if row is not None and row[0] == file_hash:
+            return
+
+        with self.conn:
+            self.conn.execute("DELETE FROM assignments WHERE layer = ?", (name,))
+            self.conn.execute("INSERT OR REPLACE INTO layers (name, hash) VALUES (?, ?)", (name, file_hash))
+
+    def load(self, name):
+        rows = self.conn.execute("SELECT lon, lat, value FROM assignments WHERE layer = ?", (name,))
+        return { (lon, lat): value for lon, lat, value in rows }
+
+    def store(self, name, items):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO assignments (layer, lon, lat, value) VALUES (?, ?, ?, ?)",
+                [(name, lon, lat, value) for (lon, lat), value in items],
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def findCachedValues(cache, layer_defs, locations, *, workers=0, search=None, layers=None):
+    """Look up every layer value for every location, only searching uncached ones
+
+    Each layer only searches the locations it doesn't have, so a change to
+    one geojson file doesn't redo the search of the others. Layers missing
+    the same locations are searched together. The layers are only loaded if
+    there is something to search for, unless they're given in layers.
+    Returns a list of values per layer, in the same order as locations.
+    search replaces gis_search.findValues if given.
+    """
+    search = search or gis_search.findValues
+    keys = [locationKey(x) for x in locations]
+    gis_search.reportDedupe(keys)
+    key_locations = keyLocations(keys, locations)
+    known = []
+    searches = defaultdict(list) ## Missing keys -> positions of the layers missing them
+    for i, layer_def in enumerate(layer_defs):
+        cache.useLayer(layer_def.name, fileHash(layer_def.path))
+        layer_known = cache.load(layer_def.name)
+        known.append(layer_known)
+        missing = tuple(sorted(x for x in key_locations if x not in layer_known))
+        if missing:
+            searches[missing].append(i)
+
+    for missing, positions in searches.items():
+        names = ", ".join(layer_defs[i].name for i in positions)
+        print(f"Searching GIS layers {names} for {len(missing)} uncached locations")
+        search_layers = None if layers is None else [layers[i] for i in positions]
+        found = search([layer_defs[i] for i in positions], pointsOf(missing, key_locations), workers=workers, layers=search_layers)
+        for i, values in zip(positions, found):
+            items = list(zip(missing, values))
+            cache.store(layer_defs[i].name, items)
+            known[i].update(items)
+
+    if not searches:
+        print("All locations found in the GIS cache")
+
+    return [[layer_known.get(x) for x in keys] for layer_known in known]
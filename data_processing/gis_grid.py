@@ -0,0 +1,85 @@
+import os
+
+import numpy as np
+import shapely
+
+from cache_utils import replacing
+
+## Cell size in degrees, about 17m east-west and 22m north-south in Cambridge
+RESOLUTION = 0.0002
+
+## Cell markers. EMPTY matches the "not found" value of GeometryIndex.queryMany
+EMPTY    = -1
+BOUNDARY = -2
+
+
+def gridPath(path):
+    return path + ".grid.npz"
+
+
+class GridIndex:
+    """Lat/lon raster over a layer for constant time lookups
+
+    Each cell holds the index of the one polygon that covers it, EMPTY if no
+    polygon touches it, or BOUNDARY if it has to be resolved by an exact
+    polygon test
+    """
+    def __init__(self, cells, origin, resolution):
+        self.cells      = cells
+        self.origin     = np.asarray(origin, dtype=float)
+        self.resolution = resolution
+
+    @classmethod
+    def build(cls, index, bounds, resolution=RESOLUTION):
+        """Rasterize a GeometryIndex over the (minx, miny, maxx, maxy) bounds"""
+        min_x, min_y, max_x, max_y = bounds
+        n_x = int(np.ceil((max_x - min_x) / resolution))
+        n_y = int(np.ceil((max_y - min_y) / resolution))
+        xs = min_x + np.arange(n_x) * resolution
+        ys = min_y + np.arange(n_y) * resolution
+        grid_x, grid_y = np.meshgrid(xs, ys, indexing='ij')
+        boxes = shapely.box(grid_x.ravel(), grid_y.ravel(), grid_x.ravel() + resolution, grid_y.ravel() + resolution)
+
+        ## Count the polygons touching each cell
+        cell_idx, geom_idx = index.tree.query(boxes, predicate='intersects')
+        counts = np.bincount(cell_idx, minlength=len(boxes))
+        cells = np.full(len(boxes), BOUNDARY, dtype=np.int32)
+        cells[counts == 0] = EMPTY
+
+        ## A cell with a single polygon only gets it if it's fully inside
+        single = counts[cell_idx] == 1
+        cell_idx, geom_idx = cell_idx[single], geom_idx[single]
+        geometries = np.asarray(index.geometries, dtype=object)
+        inside = shapely.contains_properly(geometries[geom_idx], boxes[cell_idx])
+        cells[cell_idx[inside]] = geom_idx[inside]
+
+        return cls(cells.reshape(n_x, n_y), (min_x, min_y), resolution)
+
+    @classmethod
+    def load(cls, path, source_hash, resolution=RESOLUTION):
+        """Load a cached grid, or None if it's missing or stale"""
+        if not os.path.isfile(path):
+            return None
+
+        with np.load(path) as data:
+            if str(data['source_hash']) != source_hash or float(data['resolution']) != resolution:
+                return None
+
+            return cls(data['cells'], data['origin'], resolution)
+
+    def save(self, path, source_hash):
+        ## savez adds .npz to a path that doesn't end in it
+        with replacing(path, suffix=".tmp.npz") as tmp_path:
+            np.savez(tmp_path, cells=self.cells, origin=self.origin, resolution=self.resolution, source_hash=source_hash)
+
+    def lookup(self, points):
+        """Return the cell value for each point, BOUNDARY if outside the grid"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        found = np.full(len(points), BOUNDARY, dtype=np.int64)
+        with np.errstate(invalid='ignore'):
+            cell = np.floor((points - self.origin) / self.resolution)
+            inside = (cell >= 0).all(axis=1) & (cell < self.cells.shape).all(axis=1)
+
+        cell = cell[inside].astype(np.int64)
+        found[inside] = self.cells[cell[:, 0], cell[:, 1]]
+        return found
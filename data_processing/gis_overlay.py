@@ -0,0 +1,151 @@
+import json
+import os
+
+import numpy as np
+import shapely
+
+import gis
+import gis_search
+from cache_utils import fileHash, replacing
+
+
+def overlayPath(blocks_path):
+    return blocks_path + ".zones.overlay.json"
+
+
+class BlockZoneOverlay:
+    """For each city block, the zoning districts that can contain its points
+
+    A point inside a block can only be inside a zone whose interior meets the
+    block's interior, so only those zones need to be tested. If the block is
+    completely covered by its only candidate, no test is needed at all.
+    """
+    def __init__(self, candidates, covered):
+        self.candidates = candidates ## Block ID -> sorted zone feature indices
+        self.covered    = covered    ## Block ID -> zone feature index or None
+
+    @classmethod
+    def build(cls, blocks, zones):
+        block_geometries = np.asarray(blocks.index.geometries, dtype=object)
+        zone_geometries  = np.asarray(zones.index.geometries, dtype=object)
+        block_idx, zone_idx = zones.index.tree.query(block_geometries, predicate='intersects')
+
+        ## Zones that only share an edge with the block can't contain its points
+        overlap = ~shapely.touches(block_geometries[block_idx], zone_geometries[zone_idx])
+        block_idx, zone_idx = block_idx[overlap], zone_idx[overlap]
+
+        block_ids = blocks.featureValues(blocks.secondary_id_key)
+        candidates = { x: [] for x in block_ids }
+        for b, z in sorted(zip(block_idx.tolist(), zone_idx.tolist())):
+            candidates[block_ids[b]].append(z)
+
+        covered = {}
+        for i, block_id in enumerate(block_ids):
+            zone_list = candidates[block_id]
+            if len(zone_list) == 1 and zone_geometries[zone_list[0]].covers(block_geometries[i]):
+                covered[block_id] = zone_list[0]
+            else:
+                covered[block_id] = None
+
+        return cls(candidates, covered)
+
+    @classmethod
+    def load(cls, path, source_hash):
+        """Load a saved overlay, or None if it's missing or stale"""
+        if not os.path.isfile(path):
+            return None
+
+        with open(path) as f:
+            data = json.load(f)
+
+        if data['source_hash'] != source_hash:
+            return None
+
+        candidates = { block_id: zone_list for block_id, _, zone_list in data['blocks'] }
+        covered    = { block_id: zone for block_id, zone, _ in data['blocks'] }
+        return cls(candidates, covered)
+
+    def save(self, path, source_hash):
+        data = {
+            'source_hash': source_hash,
+            'blocks': [(x, self.covered[x], self.candidates[x]) for x in self.candidates],
+        }
+        with replacing(path) as tmp_path, open(tmp_path, 'w') as f:
+            json.dump(data, f)
+
+    def findFirst(self, zones, points, block_ids):
+        """Index of the first zone containing each point, given the block of each point
+
+        Points without a known block fall back to a full search of the zones
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        found = np.full(len(points), -1, dtype=np.int64)
+        fallback = []
+        by_block = {}
+        for i, block_id in enumerate(block_ids):
+            if block_id not in self.candidates:
+                fallback.append(i)
+            elif self.covered[block_id] is not None:
+                found[i] = self.covered[block_id]
+            else:
+                by_block.setdefault(block_id, []).append(i)
+
+        ## Test the few candidate zones of each block in order
+        geometries = zones.index.geometries
+        for block_id, idx in by_block.items():
+            idx = np.array(idx)
+            for zone in self.candidates[block_id]:
+                inside = shapely.contains_xy(geometries[zone], points[idx, 0], points[idx, 1])
+                found[idx[inside]] = zone
+                idx = idx[~inside]
+                if not len(idx):
+                    break
+
+        if fallback:
+            found[fallback] = zones.index.queryMany(points[fallback])
+
+        return found
+
+
+def loadOverlay(blocks, zones, path=None):
+    """Load the overlay for a pair of layers, building and saving it if needed"""
+    path = path or overlayPath(blocks.path)
+    source_hash = f"{fileHash(blocks.path)}:{fileHash(zones.path)}"
+    overlay = BlockZoneOverlay.load(path, source_hash)
+    if overlay is None:
+        print(f"Building block to zone overlay {path}")
+        overlay = BlockZoneOverlay.build(blocks, zones)
+        overlay.save(path, source_hash)
+
+    return overlay
+
+
+def _isOverlayPair(layer_defs):
+    blocks = [x for x in layer_defs if issubclass(x.layer_type, gis.CityBlocks)]
+    zones = [x for x in layer_defs if issubclass(x.layer_type, gis.ZoningDistricts)]
+    return len(layer_defs) == 2 and len(blocks) == 1 and len(zones) == 1
+
+
+def findValues(layer_defs, points, *, workers=0, layers=None):
+    """Same as gis_search.findValues, but zones are searched within the blocks found first
+
+    Needs exactly one CityBlocks and one ZoningDistricts layer. Only the
+    block search uses the workers. Other layers, like a single one left to
+    search by gis_cache, are searched as in gis_search.findValues.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if not _isOverlayPair(layer_defs):
+        return gis_search.findValues(layer_defs, points, workers=workers, layers=layers)
+
+    layers = layers or [gis_search.loadLayer(x) for x in layer_defs]
+    block_def, blocks = next((x, y) for x, y in zip(layer_defs, layers) if issubclass(x.layer_type, gis.CityBlocks))
+    zones             = next(y for x, y in zip(layer_defs, layers) if issubclass(x.layer_type, gis.ZoningDistricts))
+    if workers > 1:
+        found_blocks, = gis_search.findValues([block_def], points, workers=workers, layers=[blocks])
+    else:
+        found_blocks = blocks.findValues(points, block_def.key).tolist()
+
+    zones.setOverlay(loadOverlay(blocks, zones))
+    found_zones = zones.findZones(points, blocks=found_blocks).tolist()
+
+    return [found_blocks if x is block_def else found_zones for x in layer_defs]
@@ -0,0 +1,106 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import shapely
+
+from gis import GeometryIndex
+
+## Options are extra keyword arguments for the layer type
+LayerDef = namedtuple('LayerDef', ['name', 'path', 'layer_type', 'key', 'options'], defaults=(None,))
+
+## Coordinates are rounded to 7 decimal places (about 1cm) to make keys
+PRECISION = 7
+SCALE     = 10 ** PRECISION
+
+## Per process layers, set up once by the pool initializer
+_worker_layers = None
+
+
+def locationKey(location):
+    """Turn a (lon, lat) pair into a hashable integer key"""
+    if location is None or None in location:
+        return None
+
+    lon, lat = location
+    return (round(lon * SCALE), round(lat * SCALE))
+
+
+def keyLocations(keys, locations):
+    """First location of each key, so the search uses real coordinates and the key only dedupes"""
+    first = {}
+    for key, location in zip(keys, locations):
+        if key is not None:
+            first.setdefault(key, location)
+
+    return first
+
+
+def pointsOf(keys, key_locations):
+    """Nx2 lon/lat array of the locations of keys"""
+    return np.array([key_locations[x] for x in keys], dtype=float).reshape(-1, 2)
+
+
+def reportDedupe(keys):
+    distinct = len({ x for x in keys if x is not None })
+    ratio = len(keys) / distinct if distinct else 0
+    print(f"Found {distinct} distinct locations for {len(keys)} buildings ({ratio:.2f} buildings per location)")
+
+
+def loadLayer(layer_def):
+    """Load a layer with only the looked up property"""
+    return layer_def.layer_type(layer_def.path, properties=(layer_def.key,), **(layer_def.options or {}))
+
+
+def _initWorker(payloads):
+    global _worker_layers ## pylint: disable=global-statement
+    _worker_layers = []
+    for wkbs, values in payloads:
+        index = GeometryIndex(shapely.from_wkb(wkbs))
+        _worker_layers.append((index, np.array(values + [None], dtype=object)))
+
+
+def _searchChunk(points):
+    return [values[index.queryMany(points)].tolist() for index, values in _worker_layers]
+
+
+def findValues(layer_defs, points, *, workers=0, chunks_per_worker=4, layers=None):
+    """Search every layer for every lon/lat point
+
+    Returns a list of values per layer, in the same order as points. With
+    more than one worker the points are split into chunks and searched in a
+    process pool. Each worker rebuilds the layers once from WKB instead of
+    parsing the geojson files again. layers are already loaded layers for
+    layer_defs, see source_loader.
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    layers = layers or [loadLayer(x) for x in layer_defs]
+    if workers <= 1 or len(points) < workers:
+        return [layer.findValues(points, x.key).tolist() for layer, x in zip(layers, layer_defs)]
+
+    payloads = [layer.toWkb(x.key) for layer, x in zip(layers, layer_defs)]
+    chunks = np.array_split(points, workers * chunks_per_worker)
+    results = [[] for _ in layer_defs]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(payloads,)) as executor:
+        ## map() yields in submission order, so the merge is deterministic
+        for chunk_results in executor.map(_searchChunk, chunks):
+            for result, values in zip(results, chunk_results):
+                result.extend(values)
+
+    return results
+
+
+def findUniqueValues(layer_defs, locations, *, workers=0, search=None, layers=None):
+    """Same as findValues, but each distinct location is only searched once
+
+    Takes a list of (lon, lat) pairs. Results are fanned back out so there
+    is still one value per location. search replaces findValues if given.
+    """
+    search = search or findValues
+    keys = [locationKey(x) for x in locations]
+    reportDedupe(keys)
+    key_locations = keyLocations(keys, locations)
+    unique = sorted(key_locations)
+    found = search(layer_defs, pointsOf(unique, key_locations), workers=workers, layers=layers)
+    lookups = [dict(zip(unique, values)) for values in found]
+    return [[lookup.get(x) for x in keys] for lookup in lookups]
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+
+"""Compact sidecars for geojson layers
+
+A binary sidecar holds the feature IDs and properties as a small JSON header,
+followed by an offset table and the WKB of every geometry. The file is
+memory mapped, so opening it costs almost nothing and geometries are only
+decoded when a spatial index is needed.
+
+An ID sidecar only holds the feature ID to secondary ID map of a layer, for
+scripts that just join on IDs.
+
+Usage: gis_store.py <geojson>...
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+from cache_utils import replacing
+
+MAGIC     = b'GISBIN01'
+HEADER    = struct.Struct('<8sQQ') ## Magic, JSON header length, feature count
+EXTENSION = ".gisbin"
+
+
+def sidecarPath(path):
+    return path + EXTENSION
+
+
+def isFresh(path, store_path):
+    """The sidecar is usable if it exists and is newer than the source"""
+    return os.path.isfile(store_path) and os.path.getmtime(store_path) >= os.path.getmtime(path)
+
+
+def idIndexPath(path, key):
+    return f"{path}.{key}.ids.json"
+
+
+def writeIdIndex(path, key, ids, secondary_ids):
+    out_path = idIndexPath(path, key)
+    with replacing(out_path) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump({ 'key': key, 'ids': ids, 'secondary_ids': secondary_ids }, f)
+
+    return out_path
+
+
+def readIdIndex(path, key):
+    """Return the (ids, secondary_ids) lists of a layer"""
+    with open(idIndexPath(path, key)) as f:
+        data = json.load(f)
+
+    return (data['ids'], data['secondary_ids'])
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def writeSidecar(path, *, properties=None, out_path=None):
+    """Convert a geojson file into a sidecar
+
+    Only the properties listed are kept, or all of them if None
+    """
+    out_path = out_path or sidecarPath(path)
+    with open(path) as f:
+        features = json.load(f)['features']
+
+    ids = [x['id'] for x in features]
+    props = [x['properties'] for x in features]
+    if properties is not None:
+        props = [{ key: x.get(key) for key in properties } for x in props]
+
+    wkbs = shapely.to_wkb([shape(x['geometry']) for x in features]).tolist()
+    offsets = np.zeros(len(wkbs) + 1, dtype='<u8')
+    offsets[1:] = np.cumsum([len(x) for x in wkbs])
+
+    header = json.dumps({ 'ids': ids, 'properties': props }).encode('utf-8')
+    padding = _align(HEADER.size + len(header)) - HEADER.size - len(header)
+
+    with replacing(out_path) as tmp_path, open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(header), len(ids)))
+        f.write(header)
+        f.write(b'\0' * padding)
+        f.write(offsets.tobytes())
+        for wkb in wkbs:
+            f.write(wkb)
+
+    return out_path
+
+
+class Sidecar:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_len, count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a GIS sidecar")
+
+        header = json.loads(self._mmap[HEADER.size:HEADER.size + header_len])
+        self.ids        = header['ids']
+        self.properties = header['properties']
+        table_start     = _align(HEADER.size + header_len)
+        self.offsets    = np.frombuffer(self._mmap, dtype='<u8', count=count + 1, offset=table_start)
+        self.data_start = table_start + self.offsets.nbytes
+
+    def __len__(self):
+        return len(self.ids)
+
+    def wkb(self, i):
+        return self._mmap[self.data_start + int(self.offsets[i]):self.data_start + int(self.offsets[i + 1])]
+
+    def wkbs(self):
+        return [self.wkb(i) for i in range(len(self))]
+
+    def geometries(self):
+        return list(shapely.from_wkb(self.wkbs()))
+
+
+def main(paths):
+    for path in paths:
+        print(f"Wrote {writeSidecar(path)}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
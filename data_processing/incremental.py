@@ -0,0 +1,153 @@
+"""Incremental runs of process_all_sources.py
+
+After each run the hash of every source row is saved, keyed by PID (ml for
+the master list), along with the building each property went to. The next
+run only rebuilds the buildings that one of the changed rows touches, and
+patches them into the output of the last run as it's read back.
+"""
+
+import hashlib
+import heapq
+import json
+import os
+
+from collections import defaultdict, namedtuple
+
+import data_file
+import data_sources as ds
+from cache_utils import fileHash, replacing
+from combine_sources import findBuildingId
+
+STATE_VERSION = 1
+
+## Source -> Entry method giving the key its rows are compared by
+SOURCE_KEYS = {
+    'master':  'getBuildingId',
+    'main':    'getPropertyId',
+    'website': 'getPropertyId',
+    'gis':     'getPropertyId',
+}
+
+## Building IDs and PIDs to rebuild, and PIDs that are gone from the main db
+Changes = namedtuple('Changes', ['buildings', 'pids', 'removed'])
+
+
+def rowHash(entry):
+    values = tuple(getattr(entry, x) for x in entry.COLUMNS)
+    return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()
+
+
+def rowHashes(db, method):
+    """Hash of the rows of each key. Rows that share a key are hashed together"""
+    get_key = getattr(db.data_type, method)
+    hashes = defaultdict(str)
+    for entry in db:
+        hashes[get_key(entry)] += rowHash(entry)
+
+    return dict(hashes)
+
+
+def assignBuildings(main_db, building_ids):
+    """Building ID of each main row, by PID"""
+    assigned = defaultdict(list)
+    for main_entry in main_db:
+        entry = ds.CombinedEntry(main_entry)
+        assigned[entry.id].append(findBuildingId(entry, building_ids))
+
+    return dict(assigned)
+
+
+class IngestState:
+    def __init__(self, layers, hashes, assigned, output=None):
+        self.layers   = layers   ## GIS layer name -> file hash
+        self.hashes   = hashes   ## Source -> key -> row hash
+        self.assigned = assigned ## PID -> building ID of each of its main rows
+        self.output   = output   ## Hash of the output written from this state
+
+    @classmethod
+    def fromSources(cls, sources, layers, building_ids):
+        hashes = { name: rowHashes(getattr(sources, name), method) for name, method in SOURCE_KEYS.items() }
+        return cls(layers, hashes, assignBuildings(sources.main, building_ids))
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved state, or None if there's none or it's from another version"""
+        if not os.path.isfile(path):
+            return None
+
+        with open(path) as f:
+            data = json.load(f)
+
+        if data['version'] != STATE_VERSION:
+            return None
+
+        ## Keys are stored as pairs since PIDs are ints
+        hashes = { name: dict(pairs) for name, pairs in data['hashes'].items() }
+        return cls(data['layers'], hashes, dict(data['assigned']), data['output'])
+
+    def save(self, path, out_path):
+        """Save the state along with the hash of the output it was written to"""
+        self.output = fileHash(out_path)
+        data = {
+            'version':  STATE_VERSION,
+            'layers':   self.layers,
+            'hashes':   { name: list(hashes.items()) for name, hashes in self.hashes.items() },
+            'assigned': list(self.assigned.items()),
+            'output':   self.output,
+        }
+        with replacing(path) as tmp_path, open(tmp_path, 'w') as f:
+            json.dump(data, f)
+
+
+def _changedKeys(old, new):
+    return { x for x in old.keys() | new.keys() if old.get(x) != new.get(x) }
+
+
+def findChanges(old, new, out_path):
+    """Compare the state of the last run with the current one
+
+    Returns None if everything has to be rebuilt: there's no last run, the
+    GIS layers changed, or the output isn't the one the last run wrote.
+    """
+    if old is None or old.layers != new.layers:
+        return None
+    if not os.path.isfile(out_path) or fileHash(out_path) != old.output:
+        return None
+
+    pids = set()
+    for name in ('main', 'website', 'gis'):
+        pids |= _changedKeys(old.hashes[name], new.hashes[name])
+
+    ## Unchanged properties also move when a building they could belong to
+    ## comes or goes
+    pids |= _changedKeys(old.assigned, new.assigned)
+
+    buildings = _changedKeys(old.hashes['master'], new.hashes['master'])
+    for pid in pids:
+        buildings.update(old.assigned.get(pid, ()))
+        buildings.update(new.assigned.get(pid, ()))
+
+    buildings.discard(None)
+
+    ## Every property of a rebuilt building is combined again
+    rebuilt = { pid for pid, ids in new.assigned.items() if pid in pids or buildings.intersection(ids) }
+    return Changes(buildings, rebuilt, pids - new.assigned.keys())
+
+
+def _isRebuilt(kind, value, changes, pids):
+    if kind == 'building':
+        return value['id'] in changes.buildings
+    if kind == 'rouge_property':
+        return value['id'] in pids
+
+    return value in pids
+
+
+def patchRecords(records, new_records, changes):
+    """Records of the last run's output with the rebuilt buildings and properties replaced
+
+    Both are in file order, so they're merged as they're read.
+    """
+    pids = changes.pids | changes.removed
+    kept = (x for x in records if not _isRebuilt(*x, changes, pids))
+    return heapq.merge(kept, new_records, key=lambda x: data_file.recordKey(*x))
@@ -2,15 +2,15 @@
 
 ## pylint: disable=too-many-locals
 
-import json
 import os
 
 from collections import defaultdict
 
 import constants as cnts
+import data_file
 
 ROOT      = "/home/charles/Projects/cambridge_property_db/"
-data_path = os.path.join(ROOT, "all_data.json")
+data_path = os.path.join(ROOT, "all_data.ndjson")
 out_path  = os.path.join(ROOT, "stats/non_conformance.csv")
 
 
@@ -23,12 +23,8 @@ def format_perc(val, total):
 
 
 def main():
-    data = None
-    with open(data_path) as f:
-        data = json.load(f)
-
     prop_zones = defaultdict(list)
-    for b in data['buildings']:
+    for b in data_file.readBuildings(data_path):
         prop_zones[b['zone']].append(b)
 
     writeNonConformance(prop_zones)
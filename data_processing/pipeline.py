@@ -0,0 +1,170 @@
+"""Named stages of a script, each memoized on disk
+
+A stage's result is saved under a key made from its name, the source of its
+function and of the modules it lists, the content of the files it lists, its
+parameters and the keys of the stages it takes as inputs. Running a stage
+loads its saved result if there is one for the current key, and otherwise
+runs its inputs and then the stage. An interrupted run picks up after the
+last stage it completed, and a change to one stage only reruns it and the
+stages that take its result.
+
+A stage that isn't cached runs every time. Its key is a hash of its result,
+so the stages after it are still reused when the result doesn't change.
+
+With a RunLog, the time and rows of each stage are recorded in it, and the
+events a stage counted are saved with its result so a loaded stage still
+adds them to the run's counts.
+
+A stage can also write a file rather than return everything it makes. The
+file is named after the stage's key and kept next to its result, so a result
+loaded from the cache always refers to the file written along with it. Files
+of stages that aren't saved go in a temporary directory, removed by close.
+"""
+
+import hashlib
+import inspect
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+from collections import namedtuple
+
+from cache_utils import fileHash, replacing
+from run_log import logger
+
+Stage = namedtuple('Stage', ['name', 'function', 'inputs', 'params', 'files', 'modules', 'cache', 'rows', 'output'])
+
+## Saved results are (result, event counts)
+RESULT_FORMAT = 2
+
+
+def _hash(*parts):
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+class Pipeline:
+    def __init__(self, cache_dir, *, log=None):
+        self.cache_dir = cache_dir ## None to run every stage
+        self.log       = log
+        self.stages = {}
+        self._keys = {}
+        self._results = {}
+        self._tmp_dir = None
+
+    def stage(self, name, *, inputs=(), params=None, files=(), modules=(), cache=True, rows=None, output=None):
+        """Decorator adding a function as a stage
+
+        The function is called with the results of the inputs, in order, and
+        params as keyword arguments. files are paths whose content the
+        result depends on, modules are the modules whose code it depends on.
+        rows gives the number of rows in a result, for the stage's throughput.
+        output is the extension of a file the stage writes. The function gets
+        its path as output_path, and has to replace it in one step, so a
+        file that's there is complete.
+        """
+        def add(function):
+            self.stages[name] = Stage(name, function, tuple(inputs), dict(params or {}), tuple(files), tuple(modules), cache, rows, output)
+            return function
+
+        return add
+
+    def _resultPath(self, name, key):
+        return os.path.join(self.cache_dir, f"{name}-{key[:16]}.pickle")
+
+    def _outputPath(self, stage):
+        if stage.cache and self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            return os.path.join(self.cache_dir, f"{stage.name}-{self.key(stage.name)[:16]}.{stage.output}")
+
+        ## Not kept, but still written somewhere for the rest of the run
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix="pipeline-")
+
+        return os.path.join(self._tmp_dir, f"{stage.name}.{stage.output}")
+
+    def key(self, name):
+        if name in self._keys:
+            return self._keys[name]
+
+        stage = self.stages[name]
+        if not stage.cache:
+            ## Only known once it has run
+            self.run(name)
+            return self._keys[name]
+
+        code = [inspect.getsource(stage.function)] + [fileHash(x.__file__) for x in stage.modules]
+        files = [(x, fileHash(x)) for x in stage.files]
+        inputs = [self.key(x) for x in stage.inputs]
+        self._keys[name] = _hash(name, RESULT_FORMAT, code, files, sorted(stage.params.items()), inputs)
+        return self._keys[name]
+
+    def run(self, name):
+        """Result of a stage, loaded if it was saved or computed along with any inputs it needs"""
+        if name in self._results:
+            return self._results[name]
+
+        stage = self.stages[name]
+        path = None
+        if stage.cache and self.cache_dir is not None:
+            path = self._resultPath(name, self.key(name))
+
+        loaded = path is not None and os.path.isfile(path)
+        if loaded and stage.output is not None:
+            ## A result is no use without its file
+            loaded = os.path.isfile(self._outputPath(stage))
+        if loaded:
+            logger.info("Stage %s: loading saved result", name)
+            start = time.perf_counter()
+            with open(path, 'rb') as f:
+                result, counts = pickle.load(f)
+            if self.log is not None:
+                self.log.addCounts(counts)
+        else:
+            args = [self.run(x) for x in stage.inputs]
+            logger.info("Stage %s: running", name)
+            before = self.log.counts.copy() if self.log is not None else None
+            start = time.perf_counter()
+            params = dict(stage.params)
+            if stage.output is not None:
+                params['output_path'] = self._outputPath(stage)
+
+            result = stage.function(*args, **params)
+            logger.info("Stage %s: done in %.1fs", name, time.perf_counter() - start)
+            counts = self.log.counts - before if self.log is not None else {}
+            if path is not None:
+                self._save(name, path, (result, dict(counts)))
+            elif not stage.cache:
+                self._keys[name] = _hash(name, hashlib.sha256(pickle.dumps(result)).hexdigest())
+
+        if self.log is not None:
+            rows = stage.rows(result) if stage.rows is not None else None
+            self.log.stage(name, time.perf_counter() - start, rows, loaded=loaded)
+
+        self._results[name] = result
+        return result
+
+    def close(self):
+        """Remove the files of the stages that aren't saved
+
+        Their results are dropped too, a later run computes them again.
+        """
+        if self._tmp_dir is None:
+            return
+
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        self._tmp_dir = None
+        for name, stage in self.stages.items():
+            if stage.output is not None and not (stage.cache and self.cache_dir is not None):
+                self._results.pop(name, None)
+
+    def _save(self, name, path, result):
+        with replacing(path) as tmp_path, open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        ## Only the latest result of each stage is kept, along with its output
+        latest = os.path.basename(path)[:-len(".pickle")]
+        for filename in os.listdir(self.cache_dir):
+            if filename.startswith(f"{name}-") and filename.split('.')[0] != latest:
+                os.remove(os.path.join(self.cache_dir, filename))
@@ -1,129 +1,248 @@
 #!/usr/bin/python3
 
-import json
 import os
 
-import progressbar
-
+import columnar
+import combine_sources
+import constants as cnts
+import data_file
 import data_sources as ds
+import geojson_stream
 import gis
-from real_property import Property, Building
+import gis_cache as gc
+import gis_grid
+import gis_overlay
+import gis_search
+import gis_store
+import incremental
+import real_property
+import run_log
+import source_loader
+import validation
+from cache_utils import fileHash
+from pipeline import Pipeline
 
 DO_GIS=True
+COLUMNAR=False ## Load the sources into typed columns instead of one object per row
+GIS_WORKERS=0 ## Processes used to search the GIS layers, 0 to search in this one
+GIS_GRID=False ## Use a raster grid over the city to skip most polygon tests
+GIS_OVERLAY=False ## Find blocks first, then only test the zones overlapping each block
+LOAD_WORKERS=4 ## Processes used to parse the source files, 0 to load them one after another
+INCREMENTAL=False ## Only rebuild what changed in the sources since the last run, see incremental.py
+VERBOSE=False ## Log every property and every missing source, alias and duplicate instead of a few samples
 
 
 ## All file paths
 ROOT         = "/home/charles/Projects/cambridge_property_db/"
 DATA         = os.path.join(ROOT, "csvs")
 GEOJSON      = os.path.join(ROOT, "geojson")
+CACHE        = os.path.join(ROOT, "cache")
 main_path    = os.path.join(DATA, "ASSESSING_PropertyDatabase_FY2023.csv")
 #main_path    = os.path.join(DATA, "sigh.csv")
 website_path = os.path.join(DATA, "properties.tsv")
 master_path  = os.path.join(DATA, "ADDRESS_MasterAddressList.csv")
 gis_path     = os.path.join(DATA, "gis_property_info.tsv")
-out_path     = os.path.join(ROOT, "all_data.json")
+out_path     = os.path.join(ROOT, "all_data.ndjson")       ## See data_file.py
+report_path  = os.path.join(ROOT, "conflicts.json")
+report_csv   = os.path.join(ROOT, "conflicts.csv")        ## None to only write the JSON report
+summary_path = os.path.join(ROOT, "run_summary.json")
 zoning_path  = os.path.join(GEOJSON, "CDD_ZoningDistricts.geojson")
 blocks_path  = os.path.join(GEOJSON, "ADDRESS_MasterAddressBlocks.geojson")
-
-
-## Load all data sources
-master_db  = ds.MasterDatabase(master_path,   verbose=True)
-main_db    = ds.MainDatabase(main_path,       verbose=True)
-website_db = ds.WebsiteDatabase(website_path, verbose=True)
-gis_db     = ds.GisDatabase(gis_path,         verbose=True)
-zones      = gis.ZoningDistricts(zoning_path)
-blocks     = gis.CityBlocks(blocks_path)
-
-## Create buildings
-all_buildings = [Building.fromJson(x.toJson()) for x in master_db]
-building_map = {}
-for b in all_buildings:
-    if b.id not in building_map:
-        building_map[b.id] = b
-    elif building_map[b.id].object_id != b.object_id:
-        print(f"Found an alias for building {b.id}: {b.object_id}")
-        building_map[b.id].addAlias(b)
-    else:
-        print(f"Dropping duplicate for building {b.id}: {b.object_id}")
-
-buildings = building_map.values()
-
-
-## Attempt to combine property sources
-## Use main db as attoritative
-count = 0
-missing_web = []
-missing_gis = []
-missing_building = []
-for main_entry in main_db.entries:
-    count += 1
-    entry = ds.CombinedEntry(main_entry)
-    print(f"Processing property {entry.id}: {entry.address}")
-
-    ## Website
-    if entry.id in website_db:
-        entry.setWebsiteEntry(website_db[entry.id])
-    else:
-        print(f"Property {entry.id} missing website data")
-        missing_web.append(entry.id)
-
-    ## GID
-    if entry.id in gis_db:
-        entry.setGisEntry(gis_db[entry.id])
+city_path    = os.path.join(GEOJSON, "BOUNDARY_CityBoundary.geojson")
+gis_cache    = os.path.join(CACHE, "gis_assignments.sqlite") ## None to disable
+source_cache = os.path.join(CACHE, "sources")                ## None to disable
+ingest_state = os.path.join(CACHE, "ingest_state.json")
+stage_cache  = os.path.join(CACHE, "stages")                 ## None to run every stage
+
+
+## GIS layers to search
+layer_options = { 'grid_boundary': city_path } if GIS_GRID else {}
+layer_defs = (
+    gis_search.LayerDef('zone',  zoning_path, gis.ZoningDistricts, 'ZONE_TYPE', layer_options),
+    gis_search.LayerDef('block', blocks_path, gis.CityBlocks,      'UNQ_ID',    layer_options),
+)
+
+
+## Code the sources stage runs. source_cache needs pyarrow, so it's only imported when the sources are cached
+source_modules = (ds, cnts, columnar, source_loader)
+if source_cache is not None:
+    import source_cache as sc ## pylint: disable=wrong-import-position
+    source_modules += (sc,)
+
+
+## Stages of the run, see pipeline.py. Event counts and stage times go in the run summary
+log = run_log.RunLog()
+pipeline = Pipeline(stage_cache, log=log)
+
+
+@pipeline.stage(
+    'sources',
+    params={ 'columnar': COLUMNAR },
+    files=(master_path, main_path, website_path, gis_path),
+    modules=source_modules,
+    rows=lambda x: len(x.master) + len(x.main) + len(x.website) + len(x.gis),
+)
+def loadSources(*, columnar):
+    ## The GIS layers are read by threads while the workers parse the files.
+    ## They aren't saved with the stage, so once it's loaded from the cache
+    ## the gis stage only loads them if it has to search
+    return source_loader.loadSources(
+        master_path, main_path, website_path, gis_path,
+        layer_defs=layer_defs if DO_GIS and LOAD_WORKERS > 0 else (),
+        workers=LOAD_WORKERS,
+        verbose=True,
+        columnar=columnar,
+        cache_dir=source_cache,
+    )
+
+
+@pipeline.stage('changes', inputs=('sources',), cache=False, modules=(incremental,))
+def compareWithLastRun(sources):
+    """Changes since the last run, and the state to save for the next one"""
+    layer_hashes = { x.name: fileHash(x.path) for x in layer_defs } if DO_GIS else {}
+    state = incremental.IngestState.fromSources(sources, layer_hashes, sources.master.by_building_id.keys())
+    changes = incremental.findChanges(incremental.IngestState.load(ingest_state), state, out_path)
+    if changes is None:
+        print("Rebuilding everything")
     else:
-        print(f"Property {entry.id} missing GIS data")
-        missing_gis.append(entry.id)
-
-
-    ## Building
-    building = None
-    if entry.building_id in building_map:
-        building = building_map[entry.building_id]
-    elif entry.buildingIdFromMapLot() in building_map:
-        building = building_map[entry.buildingIdFromMapLot()]
-    else:
-        print(f"Property {entry.id} has no building. Couldn't find {entry.building_id}")
-        missing_building.append(entry)
-        continue
-
-    if entry.isBuilding():
-        building.setMainEntry(entry)
-    else:
-        building.addProperty(Property.fromJson(entry.toJson()))
-
-
-## Find zones and blocks
-if DO_GIS:
+        print(f"Rebuilding {len(changes.buildings)} buildings and {len(changes.pids)} properties")
+
+    return (changes, state)
+
+
+@pipeline.stage(
+    'buildings',
+    inputs=('sources', 'changes') if INCREMENTAL else ('sources',),
+    modules=(ds, cnts, combine_sources, real_property),
+    rows=lambda x: x[2].count,
+)
+def buildBuildings(sources, compared=(None, None)):
+    changes = compared[0]
+    master_entries = sources.master.entries
+    main_entries = sources.main.entries
+    if changes is not None:
+        master_entries = [x for x in sources.master if x.getBuildingId() in changes.buildings]
+        main_entries = [x for x in sources.main if x.getPropertyId() in changes.pids]
+
+    ## Create buildings
+    all_buildings, building_map = combine_sources.makeBuildings(master_entries, log=log)
+
+    ## Attempt to combine property sources
+    ## Use main db as attoritative, mismatched entries go to the conflicts report
+    combined = combine_sources.combineProperties(main_entries, sources.website, sources.gis, building_map, drop_mismatched=True, log=log)
+    return (all_buildings, building_map, combined)
+
+
+@pipeline.stage('conflicts', inputs=('buildings',), modules=(validation,), rows=lambda x: len(x['rows']))
+def findConflicts(built):
+    """Source mismatches and building conflicts, before the data stage combines the buildings' values"""
+    _, building_map, combined = built
+    return validation.conflictReport(combined.mismatches, validation.findConflicts(building_map.values()))
+
+
+@pipeline.stage(
+    'gis',
+    inputs=('sources', 'buildings'),
+    files=(zoning_path, blocks_path) + ((city_path,) if GIS_GRID else ()),
+    modules=(gis, gc, gis_grid, gis_overlay, gis_search, gis_store, geojson_stream),
+    rows=lambda x: len(x[0]),
+)
+def findZonesAndBlocks(sources, built):
+    """Zone and block of every building"""
     print("Searching GIS data for zoning district and city block")
-    with progressbar.ProgressBar(max_value=len(buildings)) as bar:
-        for i, b in enumerate(buildings):
-            b.setZone(zones.findZone(b.location))
-            b.setBlock(blocks.findBlock(b.location))
-            bar.update(i)
-
-## Final info
-empty_buildings = tuple([x for x in buildings if not x.status()])
-building_count = len(buildings)
-all_building_count = len(all_buildings)
-alias_count = all_building_count - building_count
-print(f"Processed {count} properties and {building_count} buildings")
-if alias_count:
-    print(f"Found {alias_count} building address aliases")
-if missing_building:
-    print(f"Missing building: {len(missing_building)}")
-if missing_web:
-    print(f"Missing web: {len(missing_web)}")
-if missing_gis:
-    print(f"Missing gis: {len(missing_gis)}")
-if empty_buildings:
-    print(f"Buildings without properties: {len(empty_buildings)}")
-
-data = {
-    'buildings':        [x.toJson() for x in sorted(buildings, key=lambda x: x.id)],
-    'rouge_properties': [x.toJson() for x in sorted(missing_building, key=lambda x: x.id)],
-    'missing_web':      sorted(missing_web),
-    'missing_gis':      sorted(missing_gis),
-}
-print(f"Writing to {out_path}")
-with open(out_path, 'w') as f:
-    json.dump(data, f, sort_keys=True, indent=4)
+    search = gis_overlay.findValues if GIS_OVERLAY else gis_search.findValues
+    ## Loaded along with the sources, or None
+    layers = sources.layers or None
+    ## Each distinct location is only searched once
+    locations = [b.location for b in built[1].values()]
+    if gis_cache is not None:
+        ## Layers are only loaded if some location isn't cached yet
+        cache = gc.AssignmentCache(gis_cache)
+        found = gc.findCachedValues(cache, layer_defs, locations, workers=GIS_WORKERS, search=search, layers=layers)
+        cache.close()
+    else:
+        found = gis_search.findUniqueValues(layer_defs, locations, workers=GIS_WORKERS, search=search, layers=layers)
+
+    return found
+
+
+@pipeline.stage(
+    'data',
+    inputs=('buildings', 'gis') if DO_GIS else ('buildings',),
+    modules=(real_property, data_file),
+    output='ndjson',
+    rows=lambda x: x[1],
+)
+def buildData(built, found=None, *, output_path):
+    """Set the zones and blocks, and write the records of the output as they're made
+
+    Returns the path of the records and how many there are.
+    """
+    all_buildings, building_map, combined = built
+    buildings = building_map.values()
+    if found is not None:
+        found_zones, found_blocks = found
+        for b, zone, block in zip(buildings, found_zones, found_blocks):
+            b.setZone(zone)
+            b.setBlock(block)
+
+    ## Final info
+    empty_buildings = tuple([x for x in buildings if not x.status()])
+    building_count = len(buildings)
+    all_building_count = len(all_buildings)
+    alias_count = all_building_count - building_count
+    print(f"Processed {combined.count} properties and {building_count} buildings")
+    if alias_count:
+        print(f"Found {alias_count} building address aliases")
+    if combined.missing_building:
+        print(f"Missing building: {len(combined.missing_building)}")
+    if combined.missing_web:
+        print(f"Missing web: {len(combined.missing_web)}")
+    if combined.missing_gis:
+        print(f"Missing gis: {len(combined.missing_gis)}")
+    if empty_buildings:
+        print(f"Buildings without properties: {len(empty_buildings)}")
+
+    records = data_file.outputRecords(buildings, combined.missing_building, combined.missing_web, combined.missing_gis)
+    return (output_path, data_file.writeRecords(output_path, records))
+
+
+def main():
+    """Run the stages and write the output, the report and the run summary
+
+    Guarded by __main__ since the pools of LOAD_WORKERS and GIS_WORKERS
+    import this script again in their workers under spawn.
+    """
+    run_log.setupLogging(VERBOSE)
+
+    ## In an incremental run, the report only covers what was rebuilt
+    report = pipeline.run('conflicts')
+    for name, count in sorted(report['counts'].items()):
+        print(f"Conflicts in {name}: {count}")
+    log.addCounts({ f"conflicts_{k}": v for k, v in report['counts'].items() })
+    print(f"Writing conflicts report to {report_path}")
+    validation.writeReport(report, report_path, report_csv)
+
+    ## Without a stage cache the data stage writes its records to a temporary file
+    try:
+        data_path, _ = pipeline.run('data')
+        records = data_file.readRecords(data_path)
+        if INCREMENTAL:
+            changes, state = pipeline.run('changes')
+            if changes is not None:
+                records = incremental.patchRecords(data_file.readRecords(out_path), records, changes)
+
+        print(f"Writing to {out_path}")
+        data_file.writeRecords(out_path, records)
+    finally:
+        pipeline.close()
+
+    if INCREMENTAL:
+        state.save(ingest_state, out_path)
+
+    print(f"Writing run summary to {summary_path}")
+    log.writeSummary(summary_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+
+"""SQLite store of the property sources
+
+Each source file is loaded into its own table, with the entry type's columns
+and indexes on the columns used for lookups. StoreDatabase and
+StoreMasterDatabase answer the same lookups as the in memory databases, so
+an analysis can use the store without loading every source, and any number
+of processes can read one store.
+
+Usage: property_store.py <store> <source>=<path>...
+    where source is one of main, website, gis or master
+"""
+
+import os
+import sqlite3
+import sys
+
+from operator import attrgetter
+
+import data_sources as ds
+from cache_utils import fileHash
+
+## Table name -> (Database type, column looked up by __getitem__, indexed columns)
+SOURCES = {
+    'main':    (ds.MainDatabase,    'PID',    ('PID', 'MapLot', 'GISID')),
+    'website': (ds.WebsiteDatabase, 'PropId', ('PropId', 'MapLot')),
+    'gis':     (ds.GisDatabase,     'PID',    ('PID', 'PropertyID')),
+    'master':  (ds.MasterDatabase,  'ml',     ('ml',)),
+}
+
+## Rows fetched at a time when iterating a table
+BATCH_SIZE = 1000
+
+
+def _columnList(columns):
+    return ", ".join(f'"{x}"' for x in columns)
+
+
+class PropertyStore:
+    """Source tables, each tagged with the content hash of the file it was loaded from"""
+    def __init__(self, path):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        ## Readers in other processes don't block on a writer. Transactions
+        ## are managed here, so a reload is one transaction with its DDL
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, path TEXT, hash TEXT)")
+
+    def load(self, name, path):
+        """Load a source file into its table, unless the table already holds this version of it"""
+        db_type, _, indexed = SOURCES[name]
+        file_hash = fileHash(path)
+        row = self.conn.execute("SELECT hash FROM sources WHERE name = ?", (name,)).fetchone()
+        if row is not None and row[0] == file_hash:
+            return
+
+        columns = db_type.DATA_TYPE.COLUMNS
+        get = attrgetter(*columns)
+        print(f"Loading {path} into {self.path}")
+        ## Readers see the old table until the new one is committed
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            ## No types on the columns so ints, floats and strings round trip as is
+            self.conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+            self.conn.execute(f'CREATE TABLE "{name}" ({_columnList(columns)})')
+            self.conn.executemany(
+                f'INSERT INTO "{name}" VALUES ({", ".join("?" for _ in columns)})',
+                (get(x) for x in db_type.stream(path)),
+            )
+            for column in indexed:
+                self.conn.execute(f'CREATE INDEX "{name}_{column}" ON "{name}" ("{column}")')
+
+            self.conn.execute("INSERT OR REPLACE INTO sources (name, path, hash) VALUES (?, ?, ?)", (name, path, file_hash))
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        self.conn.execute("COMMIT")
+
+    def database(self, name):
+        """Lookups on a loaded source, in place of its Database"""
+        if name == 'master':
+            return StoreMasterDatabase(self, name)
+
+        return StoreDatabase(self, name)
+
+    def query(self, sql, params=()):
+        """Run any query, for joins across the sources"""
+        return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+class StoreDatabase:
+    """Database lookups answered by a table of a PropertyStore
+
+    As with Database, a key found on several rows gives the last of them
+    """
+    def __init__(self, store, name):
+        db_type, key, _ = SOURCES[name]
+        self.store     = store
+        self.name      = name
+        self.key       = key
+        self.data_type = db_type.DATA_TYPE
+        self._select   = f'SELECT {_columnList(self.data_type.COLUMNS)} FROM "{name}"'
+
+    def _entries(self, rows):
+        return self.data_type.fromTuples(rows)
+
+    def __getitem__(self, key):
+        row = self.store.conn.execute(f'{self._select} WHERE "{self.key}" = ? ORDER BY rowid DESC LIMIT 1', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+
+        return self._entries([row])[0]
+
+    def __contains__(self, key):
+        return self.store.conn.execute(f'SELECT 1 FROM "{self.name}" WHERE "{self.key}" = ? LIMIT 1', (key,)).fetchone() is not None
+
+    def __iter__(self):
+        cursor = self.store.conn.execute(f'{self._select} ORDER BY rowid')
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                return
+
+            yield from self._entries(rows)
+
+    def __len__(self):
+        return self.store.conn.execute(f'SELECT COUNT(*) FROM "{self.name}"').fetchone()[0]
+
+
+class StoreMasterDatabase(StoreDatabase):
+    """MasterDatabase lookups, every entry of a building or none"""
+    def __getitem__(self, key):
+        rows = self.store.conn.execute(f'{self._select} WHERE "{self.key}" = ? ORDER BY rowid', (key,)).fetchall()
+        return self._entries(rows)
+
+
+def main(store_path, sources):
+    store = PropertyStore(store_path)
+    for source in sources:
+        name, path = source.split('=', 1)
+        if name not in SOURCES:
+            raise ValueError(f"Unknown source {name}, expected one of {', '.join(SOURCES)}")
+
+        store.load(name, path)
+
+    store.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], sys.argv[2:])
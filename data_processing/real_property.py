@@ -143,6 +143,15 @@ class Building:
         except:
             return None
 
+    def mainValues(self):
+        """Values that came from the main entry, before any getter combines the properties into them"""
+        return {
+            'land_area':   self._land_area,
+            'living_area': self._living_area,
+            'total_rooms': self._total_rooms,
+            'bedrooms':    self._bedrooms,
+        }
+
     @property
     def properties(self):
         return tuple(self._properties)
@@ -0,0 +1,73 @@
+"""Leveled messages, event counters and stage throughput of a run
+
+Events that can happen on every row, like a property missing from a source,
+are counted by name. The first few of each are logged as samples and the
+rest only counted, unless the logger is at DEBUG level, which also shows the
+per row detail messages. The counts and the time and rows of each stage end
+up in a summary that can be saved as JSON.
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+
+from collections import Counter
+
+logger = logging.getLogger('property_db')
+
+## Messages logged for each event before the rest are only counted
+SAMPLE_SIZE = 3
+
+
+def setupLogging(verbose=False):
+    """Log plain messages to stdout, along with the script's prints"""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    logger.propagate = False
+
+
+class RunLog:
+    def __init__(self, *, sample_size=SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.counts      = Counter() ## Event name -> times it happened
+        self.stages      = {}        ## Stage name -> timing
+        self.start       = time.time()
+
+    def event(self, name, message, *args):
+        """Count an event, and log its message if it's one of the samples"""
+        self.counts[name] += 1
+        count = self.counts[name]
+        if count <= self.sample_size or logger.isEnabledFor(logging.DEBUG):
+            logger.info(message, *args)
+        elif count == self.sample_size + 1:
+            logger.info("More %s events are only counted", name)
+
+    def addCounts(self, counts):
+        """Add counts found elsewhere, like the events of a stage saved by an earlier run"""
+        self.counts.update(counts)
+
+    def stage(self, name, seconds, rows=None, *, loaded=False):
+        entry = { 'seconds': round(seconds, 3), 'loaded': loaded }
+        if rows is not None:
+            entry['rows'] = rows
+            entry['rows_per_second'] = round(rows / seconds, 1) if seconds > 0 else None
+            logger.info("Stage %s: %d rows in %.1fs", name, rows, seconds)
+
+        self.stages[name] = entry
+
+    def summary(self):
+        return {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.start)),
+            'seconds': round(time.time() - self.start, 3),
+            'counts':  dict(sorted(self.counts.items())),
+            'stages':  self.stages,
+        }
+
+    def writeSummary(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
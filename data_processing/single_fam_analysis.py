@@ -2,26 +2,24 @@
 
 ## pylint: disable=too-many-locals
 
-import json
 import os
 
 from collections import defaultdict
 
 import constants as cnts
+import data_file
 from prop_stats import getStats, statsSummary
 
 ROOT      = "/home/charles/Projects/cambridge_property_db/"
-data_path = os.path.join(ROOT, "all_data.json")
+data_path = os.path.join(ROOT, "all_data.ndjson")
 ZONES = ("A-1", "A-2", "B")
 
 def main():
-    data = None
-    with open(data_path) as f:
-        data = json.load(f)
-
+    ## Only the buildings of the analyzed zones are kept
     prop_zones = defaultdict(list)
-    for b in data['buildings']:
-        prop_zones[b['zone']].append(b)
+    for b in data_file.readBuildings(data_path):
+        if b['zone'] in ZONES:
+            prop_zones[b['zone']].append(b)
 
     for zone in ZONES:
         analyzeZone(zone, prop_zones[zone])
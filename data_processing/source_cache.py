@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cache_utils import fileHash, replacing
+from columnar import MISSING, CategoricalColumn, Column, ColumnTable, Vocabulary
+
+
+def cachePath(cache_dir, path):
+    return os.path.join(cache_dir, os.path.basename(path) + ".parquet")
+
+
+def schemaHash(data_type):
+    """Changing a column list of the entry type invalidates its cache"""
+    schema = (
+        data_type.__name__,
+        data_type.COLUMNS,
+        data_type.INT_COLUMNS,
+        data_type.FLOAT_COLUMNS,
+        tuple(data_type.CATEGORICAL_COLUMNS),
+    )
+    return hashlib.sha256(repr(schema).encode('utf-8')).hexdigest()
+
+
+def _toArrow(column):
+    if isinstance(column, CategoricalColumn):
+        indices = pa.array(column.codes, mask=column.codes == MISSING)
+        return (pa.DictionaryArray.from_arrays(indices, pa.array(column.vocabulary.values, type=pa.string())), None)
+
+    if column.missing is not None:
+        return (pa.array(column.values, mask=column.missing), None)
+
+    values = column.values.tolist()
+    if all(x is None or isinstance(x, str) for x in values):
+        return (pa.array(values, type=pa.string()), None)
+
+    ## A number column with some text in it, keep each value's type
+    return (pa.array([None if x is None else json.dumps(x) for x in values], type=pa.string()), b'json')
+
+
+def _chunks(array):
+    return array.chunks if isinstance(array, pa.ChunkedArray) else [array]
+
+
+def _codesFromArrow(array, vocabulary):
+    """Codes of a dictionary array in a vocabulary, mapped through its dictionary without decoding the rows"""
+    codes = []
+    for chunk in _chunks(array):
+        if not pa.types.is_dictionary(chunk.type):
+            chunk = chunk.dictionary_encode()
+
+        ## The trailing MISSING is what the null rows index
+        lookup = np.append(vocabulary.encode(chunk.dictionary.to_pylist()), MISSING).astype(np.int32)
+        codes.append(lookup[chunk.indices.fill_null(-1).to_numpy(zero_copy_only=False)])
+
+    return np.concatenate(codes) if codes else np.zeros(0, dtype=np.int32)
+
+
+def _fromArrow(array, encoding, seed=None):
+    if seed is not None:
+        ## Coded with the seeded vocabulary, not the order of the file's dictionary
+        vocabulary = Vocabulary(seed)
+        return CategoricalColumn(_codesFromArrow(array, vocabulary), vocabulary)
+
+    array = array.combine_chunks() if isinstance(array, pa.ChunkedArray) else array
+    if pa.types.is_integer(array.type) or pa.types.is_floating(array.type):
+        missing = array.is_null().to_numpy(zero_copy_only=False)
+        values = array.fill_null(0).to_numpy(zero_copy_only=False)
+        return Column(values, missing)
+
+    return Column.fromValues(_pyValues(array, encoding))
+
+
+def _pyValues(array, encoding):
+    """Python values of a column, as an Entry holds them"""
+    if pa.types.is_dictionary(array.type):
+        ## Rows of one value share one string
+        values = []
+        for chunk in _chunks(array):
+            dictionary = np.array(chunk.dictionary.to_pylist() + [None], dtype=object)
+            values += dictionary[chunk.indices.fill_null(-1).to_numpy(zero_copy_only=False)].tolist()
+
+        return values
+
+    values = array.to_pylist()
+    if encoding == b'json':
+        values = [None if x is None else json.loads(x) for x in values]
+
+    return values
+
+
+def _schemaMetadata(metadata):
+    return { k.encode(): str(v).encode() for k, v in metadata.items() }
+
+
+def _writeArrow(arrow, cache_path):
+    with replacing(cache_path) as tmp_path:
+        pq.write_table(arrow, tmp_path)
+
+
+def toArrow(table, metadata):
+    names = list(table.columns)
+    arrays, fields = [], []
+    for name in names:
+        array, encoding = _toArrow(table.columns[name])
+        arrays.append(array)
+        fields.append(pa.field(name, array.type, metadata={ b'encoding': encoding } if encoding else None))
+
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields, metadata=_schemaMetadata(metadata)))
+
+
+def tableFromArrow(arrow, categorical_columns=None):
+    categorical_columns = categorical_columns or {}
+    columns = {}
+    for field, array in zip(arrow.schema, arrow.columns):
+        encoding = (field.metadata or {}).get(b'encoding')
+        columns[field.name] = _fromArrow(array, encoding, categorical_columns.get(field.name))
+
+    return ColumnTable(columns, arrow.num_rows)
+
+
+def entriesFromArrow(arrow, data_type):
+    """Entries straight from the arrays, without a ColumnTable in between"""
+    columns = []
+    for name in data_type.COLUMNS:
+        field = arrow.schema.field(name)
+        columns.append(_pyValues(arrow.column(name), (field.metadata or {}).get(b'encoding')))
+
+    return data_type.fromTuples(zip(*columns))
+
+
+def _cachedMetadata(cache_path):
+    if not os.path.isfile(cache_path):
+        return None
+
+    metadata = pq.read_schema(cache_path).metadata or {}
+    return { k.decode(): v.decode() for k, v in metadata.items() }
+
+
+def loadArrow(path, data_type, cache_dir, *, delimiter=None):
+    """Load a source file as an arrow table of the entry type's cleaned columns
+
+    The table is kept as parquet in cache_dir. It's reused if the source's
+    size and mtime are unchanged, or failing that if its content hash still
+    matches.
+    """
+    cache_path = cachePath(cache_dir, path)
+    stat = os.stat(path)
+    metadata = {
+        'source_size':  stat.st_size,
+        'source_mtime': stat.st_mtime_ns,
+        'schema':       schemaHash(data_type),
+    }
+    cached = _cachedMetadata(cache_path)
+    if cached is not None and cached.get('schema') == metadata['schema']:
+        if cached.get('source_size') == str(stat.st_size) and cached.get('source_mtime') == str(stat.st_mtime_ns):
+            return pq.read_table(cache_path)
+
+        ## Touched but maybe not changed
+        metadata['source_hash'] = fileHash(path)
+        if cached.get('source_hash') == metadata['source_hash']:
+            arrow = pq.read_table(cache_path)
+            arrow = arrow.replace_schema_metadata(_schemaMetadata(metadata))
+            _writeArrow(arrow, cache_path)
+            return arrow
+
+    table = ColumnTable.fromCsv(
+        path,
+        columns=data_type.COLUMNS,
+        int_columns=data_type.INT_COLUMNS,
+        float_columns=data_type.FLOAT_COLUMNS,
+        categorical_columns=data_type.CATEGORICAL_COLUMNS,
+        delimiter=delimiter,
+    ).select(data_type.COLUMNS)
+    metadata['source_hash'] = metadata.get('source_hash') or fileHash(path)
+    arrow = toArrow(table, metadata)
+    _writeArrow(arrow, cache_path)
+    return arrow
+
+
+def loadTable(path, data_type, cache_dir, *, delimiter=None):
+    """Load a source file as a ColumnTable of the entry type's columns, see loadArrow"""
+    return tableFromArrow(loadArrow(path, data_type, cache_dir, delimiter=delimiter), data_type.CATEGORICAL_COLUMNS)
+
+
+def loadEntries(path, data_type, cache_dir, *, delimiter=None):
+    """Load a source file as a list of entries, see loadArrow"""
+    return entriesFromArrow(loadArrow(path, data_type, cache_dir, delimiter=delimiter), data_type)
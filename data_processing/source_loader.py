@@ -0,0 +1,46 @@
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import data_sources as ds
+import gis_search
+
+class Sources(namedtuple('Sources', ['master', 'main', 'website', 'gis', 'layers'])):
+    """Everything process_all_sources.py reads. layers are in the order of the
+    layer_defs they were loaded for"""
+    __slots__ = ()
+
+    def __reduce__(self):
+        ## Layers can't be pickled, so unpickled sources have none and the
+        ## layers are loaded again where they're needed
+        return (Sources, (self.master, self.main, self.website, self.gis, None))
+
+
+def _loadDatabase(db_type, path, kwargs):
+    return db_type(path, **kwargs)
+
+
+def loadSources(master_path, main_path, website_path, gis_path, *, layer_defs=(), workers=4, **kwargs):
+    """Load the four databases and the GIS layers of layer_defs
+
+    The CSV/TSV files are parsed in a pool of worker processes while the
+    geojson layers are read by threads of this one, so loading takes about
+    as long as the largest file. With workers of 0 everything is loaded one
+    after another. kwargs are passed to each Database.
+    """
+    databases = (
+        (ds.MasterDatabase,  master_path),
+        (ds.MainDatabase,    main_path),
+        (ds.WebsiteDatabase, website_path),
+        (ds.GisDatabase,     gis_path),
+    )
+    if workers <= 0:
+        loaded = [db_type(path, **kwargs) for db_type, path in databases]
+        return Sources(*loaded, [gis_search.loadLayer(x) for x in layer_defs])
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(databases))) as processes, \
+         ThreadPoolExecutor(max_workers=max(len(layer_defs), 1)) as threads:
+        db_futures    = [processes.submit(_loadDatabase, db_type, path, kwargs) for db_type, path in databases]
+        layer_futures = [threads.submit(gis_search.loadLayer, x) for x in layer_defs]
+        ## Layers can't be sent between processes, so they stay in this one
+        layers = [x.result() for x in layer_futures]
+        return Sources(*[x.result() for x in db_futures], layers)
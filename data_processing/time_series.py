@@ -0,0 +1,173 @@
+"""Several fiscal years of the assessing database side by side
+
+Rows are keyed by PID. Numbers are kept in a years x PIDs float array per
+column, NaN where a PID is missing that year. Strings are dictionary encoded
+into int32 codes, -1 where missing, with vocabularies shared by all years so
+codes compare across years. The lot columns share one vocabulary, so a row
+is a building row where its MapLot code equals its GISID code.
+"""
+
+import numpy as np
+
+import data_sources as ds
+from columnar import MISSING, Vocabulary
+
+NUMBER_COLUMNS = (
+    'LandArea',
+    'Interior_LivingArea',
+    'Interior_NumUnits',
+    'Interior_TotalRooms',
+    'Interior_Bedrooms',
+    'Exterior_NumStories',
+    'Condition_YearBuilt',
+)
+
+## Column -> vocabulary it's encoded with
+STRING_COLUMNS = {
+    'GISID':         'lot',
+    'MapLot':        'lot',
+    'PropertyClass': 'PropertyClass',
+    'Zoning':        'Zoning',
+    'Address':       'Address',
+}
+
+
+def _number(value):
+    ## Text left in a number column counts as missing
+    if isinstance(value, (int, float)):
+        return value
+
+    return np.nan
+
+
+class TimeSeriesStore:
+    def __init__(self, years, pids, numbers, strings, vocabularies):
+        self.years        = list(years)
+        self.pids         = np.asarray(pids) ## Sorted
+        self.numbers      = numbers          ## Column -> years x PIDs float64
+        self.strings      = strings          ## Column -> years x PIDs int32 codes
+        self.vocabularies = vocabularies     ## Vocabulary name -> Vocabulary
+
+    @classmethod
+    def fromFiles(cls, paths, *, number_columns=NUMBER_COLUMNS, string_columns=STRING_COLUMNS):
+        """Load a {fiscal year: assessing database path} map
+
+        Each file is streamed with only the needed columns. A PID found more
+        than once in a year keeps its last row, as in MainDatabase.
+        """
+        years = sorted(paths)
+        columns = ('PID',) + tuple(number_columns) + tuple(string_columns)
+        per_year = []
+        for year in years:
+            rows = {}
+            for entry in ds.MainDatabase.stream(paths[year], columns=columns, where=lambda x: x.PID is not None):
+                rows[entry.PID] = entry
+
+            per_year.append(rows)
+
+        pids = sorted({ x for rows in per_year for x in rows })
+        numbers = { x: np.full((len(years), len(pids)), np.nan) for x in number_columns }
+        strings = { x: np.full((len(years), len(pids)), MISSING, dtype=np.int32) for x in string_columns }
+        ## Known values like the property classes get the same codes as in the loaders
+        vocabularies = { x: Vocabulary(ds.MAIN_CATEGORICAL_COLUMNS.get(x, ())) for x in set(string_columns.values()) }
+        position = { x: i for i, x in enumerate(pids) }
+        for y, rows in enumerate(per_year):
+            idx = np.array([position[x] for x in rows], dtype=np.int64)
+            entries = list(rows.values())
+            for name in number_columns:
+                numbers[name][y, idx] = [_number(getattr(x, name)) for x in entries]
+
+            for name, vocabulary in string_columns.items():
+                strings[name][y, idx] = vocabularies[vocabulary].encode([getattr(x, name) for x in entries])
+
+        return cls(years, pids, numbers, strings, vocabularies)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            years = data['years'].tolist()
+            pids = data['pids']
+            numbers = { x[len('number:'):]: data[x] for x in data.files if x.startswith('number:') }
+            strings = { x[len('string:'):]: data[x] for x in data.files if x.startswith('string:') }
+            vocabularies = { x[len('vocabulary:'):]: Vocabulary(data[x].tolist()) for x in data.files if x.startswith('vocabulary:') }
+
+        return cls(years, pids, numbers, strings, vocabularies)
+
+    def save(self, path):
+        arrays = { 'years': np.array(self.years), 'pids': self.pids }
+        arrays.update({ f"number:{k}": v for k, v in self.numbers.items() })
+        arrays.update({ f"string:{k}": v for k, v in self.strings.items() })
+        arrays.update({ f"vocabulary:{k}": np.array(v.values, dtype=str) for k, v in self.vocabularies.items() })
+        np.savez_compressed(path, **arrays)
+
+    def vocabulary(self, column):
+        return self.vocabularies[STRING_COLUMNS.get(column, column)]
+
+    def isBuilding(self):
+        """Rows of a whole building rather than a unit, the same test as MainDatabaseEntry.isBuilding"""
+        map_lot = self.strings['MapLot']
+        return (map_lot == MISSING) | (map_lot == self.strings['GISID'])
+
+    def groupTotals(self, column, groups, n_groups, *, where=None):
+        """Sum a number column by group for every year at once
+
+        groups is a years x PIDs array of group codes, MISSING rows are left
+        out. Returns a years x n_groups array.
+        """
+        values = self.numbers[column]
+        keep = (groups != MISSING) & ~np.isnan(values)
+        if where is not None:
+            keep &= where
+
+        year_idx = np.broadcast_to(np.arange(len(self.years))[:, None], values.shape)
+        flat = year_idx[keep] * n_groups + groups[keep]
+        totals = np.bincount(flat, weights=values[keep], minlength=len(self.years) * n_groups)
+        return totals.reshape(len(self.years), n_groups)
+
+    def groupSummary(self, groups, n_groups):
+        """Living area, land area, unit count and FAR of each group in each year
+
+        Land area and units are taken from the building rows only, since the
+        units of a condo building repeat the lot.
+        """
+        buildings = self.isBuilding()
+        living_area = self.groupTotals('Interior_LivingArea', groups, n_groups)
+        land_area = self.groupTotals('LandArea', groups, n_groups, where=buildings)
+        num_units = self.groupTotals('Interior_NumUnits', groups, n_groups, where=buildings)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            far = np.where(land_area > 0, living_area / land_area, np.nan)
+
+        return { 'living_area': living_area, 'land_area': land_area, 'num_units': num_units, 'far': far }
+
+    def byBuilding(self):
+        """Summary per building ID, the GISID of each row"""
+        return self.groupSummary(self.strings['GISID'], len(self.vocabulary('GISID')))
+
+    def byZone(self):
+        """Summary per zone, as listed in each year's Zoning column"""
+        return self.groupSummary(self.strings['Zoning'], len(self.vocabulary('Zoning')))
+
+    def byBuildingGroup(self, group_of):
+        """Summary per group of buildings, from a building ID -> group map
+
+        For blocks, group_of can be built with blocksFromBuildings. Returns the
+        summary and the group names in code order.
+        """
+        names = sorted({ x for x in group_of.values() if x is not None })
+        group_codes = { x: i for i, x in enumerate(names) }
+        lookup = np.array(
+            [group_codes.get(group_of.get(x), MISSING) for x in self.vocabulary('GISID').values] + [MISSING],
+            dtype=np.int32,
+        )
+        ## MISSING indexes the trailing entry
+        return (self.groupSummary(lookup[self.strings['GISID']], len(names)), names)
+
+
+def yearOverYear(summary):
+    """Change of every summary value from each year to the next, (years - 1) x groups"""
+    return { k: np.diff(v, axis=0) for k, v in summary.items() }
+
+
+def blocksFromBuildings(buildings):
+    """Building ID -> block map of the buildings output by process_all_sources.py, see data_file.readBuildings"""
+    return { x['id']: x['block'] for x in buildings }
@@ -0,0 +1,106 @@
+"""Every source mismatch and building conflict of a run, in one report
+
+The mismatches come from combine_sources.mergeSources. The conflicts are the
+ones Building records in its getters, between a value of the building's main
+entry and the one combined from its properties, computed here for all the
+buildings at once:
+    land_area:   the first land area found in the properties
+    living_area, total_rooms, bedrooms: the sum over the properties
+A building only conflicts where its main value is set and not 0, as in the
+getters.
+"""
+
+import csv
+import json
+import os
+
+from collections import Counter, namedtuple
+
+import numpy as np
+
+## Columns the properties are summed into
+SUM_COLUMNS = ('living_area', 'total_rooms', 'bedrooms')
+
+## value is the main entry's, combined the one from the properties
+Conflict = namedtuple('Conflict', ['building', 'column', 'value', 'combined'])
+
+REPORT_COLUMNS = ('class', 'id', 'column', 'value', 'other')
+
+
+def _floats(values):
+    return np.array([np.nan if x is None else x for x in values], dtype=np.float64)
+
+
+def _number(value):
+    ## Sums of ints come back as floats from the arrays
+    return int(value) if value.is_integer() else value
+
+
+def findConflicts(buildings):
+    """Conflicts of every building, in building then column order
+
+    Has to run before the getters of the buildings, since they replace the
+    main values with the combined ones.
+    """
+    buildings = list(buildings)
+    owners = np.array([i for i, b in enumerate(buildings) for _ in b.properties], dtype=np.int64)
+    props = [x for b in buildings for x in b.properties]
+    has_properties = np.bincount(owners, minlength=len(buildings)) > 0
+    main_values = [b.mainValues() for b in buildings]
+
+    combined = {}
+    ## First land area that's set, found by the first position of each owner
+    land_areas = _floats([x.land_area for x in props])
+    found = ~np.isnan(land_areas)
+    first_owners, first = np.unique(owners[found], return_index=True)
+    combined['land_area'] = np.full(len(buildings), np.nan)
+    combined['land_area'][first_owners] = land_areas[found][first]
+
+    for column in SUM_COLUMNS:
+        values = np.nan_to_num(_floats([getattr(x, column) for x in props]))
+        combined[column] = np.where(has_properties, np.bincount(owners, weights=values, minlength=len(buildings)), np.nan)
+
+    bad = {}
+    for column, values in combined.items():
+        main = np.nan_to_num(_floats([x[column] for x in main_values]))
+        bad[column] = (main != 0) & ~np.isnan(values) & (main != values)
+
+    conflicts = []
+    for i in np.flatnonzero(np.any(list(bad.values()), axis=0)).tolist():
+        for column, values in combined.items():
+            if bad[column][i]:
+                conflicts.append(Conflict(buildings[i].id, column, main_values[i][column], _number(values[i].item())))
+
+    return conflicts
+
+
+def _reportRows(mismatches, conflicts):
+    for m in mismatches:
+        yield (f"{m.source}_{m.column}", m.pid, m.column, m.main_value, m.value)
+    for c in conflicts:
+        yield (c.column, c.building, c.column, c.value, c.combined)
+
+
+def conflictReport(mismatches, conflicts):
+    """Counts per class, mismatches are classed by source and column"""
+    rows = [dict(zip(REPORT_COLUMNS, x)) for x in _reportRows(mismatches, conflicts)]
+    return {
+        'counts': dict(Counter(x['class'] for x in rows)),
+        'rows':   rows,
+    }
+
+
+def writeReport(report, json_path, csv_path=None):
+    """Write the report as JSON, and its rows as CSV if there's a path for it"""
+    for path in (json_path, csv_path):
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    with open(json_path, 'w') as f:
+        json.dump(report, f, sort_keys=True)
+
+    if csv_path is not None:
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(report['rows'])